@@ -0,0 +1,1136 @@
+# General imports
+import numpy as np
+import time
+import threading
+import os
+import json
+import queue
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from datetime import datetime
+
+# Networking imports
+from pylsl import StreamInlet, resolve_stream, local_clock
+from pylsl import cf_float32, cf_double64, cf_int8, cf_int16, cf_int32, cf_int64
+
+# NumPy types of the numeric LSL channel formats
+LSL_DTYPES = {cf_float32: np.float32, cf_double64: np.float64, cf_int8: np.int8,
+              cf_int16: np.int16, cf_int32: np.int32, cf_int64: np.int64}
+
+
+def _ring_write(data, stamps, head, new_data, new_stamps):
+    """
+    Write samples into a mirrored ring, where each sample is stored twice (at i and at
+    i + capacity) so any run of the last samples is contiguous. Used by LslBuffer and
+    SharedBuffer.
+
+    INPUT:
+        data, stamps: Arrays of the ring, with 2 x capacity samples
+        head: Position (in [0, capacity)) of the first sample written
+        new_data, new_stamps: Samples to write (at most capacity of them)
+    """
+    cap = len(stamps) // 2
+    n = len(new_stamps)
+
+    # Write in (at most) two slices per copy of the ring
+    first = min(n, cap - head)
+    for offset in (0, cap):
+        start = head + offset
+        data[start:start + first] = new_data[:first]
+        stamps[start:start + first] = new_stamps[:first]
+        if first < n:
+            data[offset:offset + n - first] = new_data[first:]
+            stamps[offset:offset + n - first] = new_stamps[first:]
+
+
+class Profiler(object):
+    """
+    Latency instrumentation of the online loop. Named spans (start and end timestamps
+    in the LSL clock, so they can be compared with the timestamps of the samples) are
+    written into a preallocated record array and named counters are added up, both
+    labelled with the current trial. It is off by default, and while it is off every
+    call returns straight away, so the classes can be instrumented permanently.
+
+    The module instance profiler is the one used by LslStream, LslBuffer, Epocher and
+    EmojiStimulus; switch it on with profiler.enable() (main.py does with profile=1).
+
+    METHODS:
+        __init__(capacity): Allocate the records
+        enable(enabled): Switch the recording on (or off with False)
+        clear: Forget the records and counters
+        span(name): Context manager recording the time spent inside it
+        record(name, start, end): Record a span between two timestamps (end is now
+            by default), e.g. from the timestamp of a sample to its processing
+        count(name, n): Add n to a counter
+        summary(trial): Percentiles of each span and the counters of a trial (or all)
+        report(trial): Print the summary
+        export(filename): Save the records (.npy) and the summaries (.json)
+
+    ATTRIBUTES:
+        self.enabled: Whether spans and counters are being recorded
+        self.trial: Trial the new records belong to
+        self.records: Record array with the fields name (index in names), trial, start
+            and end
+        self.used: Number of records written
+        self.dropped: Spans not recorded because the array was full
+        self.names: Index of each span name
+        self.counters: Counter values by (name, trial)
+    """
+
+    def __init__(self, capacity=2**16):
+        self.capacity = capacity
+        self.enabled = False
+        self.trial = 0
+        self.records = np.zeros(capacity, dtype=[("name", np.int32), ("trial", np.int32),
+                                                 ("start", np.float64), ("end", np.float64)])
+        self.names = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._null = contextlib.nullcontext()
+        self.clear()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def clear(self):
+        with self._lock:
+            self.used = 0
+            self.dropped = 0
+            self.counters = {}
+
+    def span(self, name):
+        if not self.enabled:
+            return self._null
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        start = local_clock()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def record(self, name, start, end=None):
+        if not self.enabled:
+            return
+        if end is None:
+            end = local_clock()
+
+        # The acquisition thread records too, so the slot is taken under the lock
+        with self._lock:
+            index = self.used
+            if index >= self.capacity:
+                self.dropped += 1
+                return
+            self.used += 1
+            name_index = self.names.setdefault(name, len(self.names))
+        self.records[index] = (name_index, self.trial, start, end)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        key = (name, self.trial)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def summary(self, trial=None):
+        """
+        Summary of the spans and counters of a trial (of all of them by default).
+
+        OUTPUT:
+            Dictionary with "spans" (name -> count, mean, p50, p95, p99 and max of the
+                durations, in ms) and "counters" (name -> value)
+        """
+        records = self.records[:self.used]
+        if trial is not None:
+            records = records[records["trial"] == trial]
+        durations = (records["end"] - records["start"]) * 1000
+
+        spans = {}
+        for name, index in self.names.items():
+            values = durations[records["name"] == index]
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            spans[name] = {"count": len(values), "mean": float(values.mean()),
+                           "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                           "max": float(values.max())}
+
+        counters = {}
+        for (name, counter_trial), value in self.counters.items():
+            if trial is None or counter_trial == trial:
+                counters[name] = counters.get(name, 0) + value
+
+        return {"spans": spans, "counters": counters}
+
+    def report(self, trial=None):
+        summary = self.summary(trial)
+        print("-- LATENCIES {0}(ms) --".format(
+            "" if trial is None else "OF TRIAL {0} ".format(trial)))
+        print("{0:<26}{1:>7}{2:>10}{3:>10}{4:>10}{5:>10}".format(
+            "span", "count", "p50", "p95", "p99", "max"))
+        for name, values in sorted(summary["spans"].items()):
+            print("{0:<26}{count:>7}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{max:>10.3f}".format(
+                name, **values))
+        for name, value in sorted(summary["counters"].items()):
+            print("{0:<26}{1:>7}".format(name, value))
+
+    def export(self, filename):
+        """ Save the records to <filename>.npy and the names, counters and summaries
+        (every trial and all together) to <filename>.json """
+        np.save(filename + ".npy", self.records[:self.used])
+        trials = np.unique(self.records["trial"][:self.used])
+        with open(filename + ".json", "w") as file_object:
+            json.dump({"names": self.names, "dropped": self.dropped,
+                       "counters": [[name, trial, value] for (name, trial), value
+                                    in self.counters.items()],
+                       "trials": {str(trial): self.summary(trial) for trial in trials},
+                       "total": self.summary()}, file_object, indent=2)
+
+
+# Instrumentation shared by the classes (off until profiler.enable() is called)
+profiler = Profiler()
+
+
+class LslStream(object):
+    """
+    This class creates the basic connection between the computer and a Lab Streaming
+    Layer data stream. With it connecting is made simpler and pulling and processing
+    information directly is made trivial.
+
+    METHODS:
+        __init__(**stream_info): Initiates a connection when the class is called
+        connect(**stream_info): Connects to a data stream in the network given 
+                defined by the keyword args
+        pull(**kwargs): Pulls a sample from the connected data stream
+        chunk(**kwargs): Pulls a chunk of samples from the data stream
+        chunk_array(max_samples, timeout): Pulls a chunk of samples into reused
+                NumPy arrays
+
+    ATTRIBUTES:
+        streams: List of found LSL streams in the network
+        inlet: Stream inlet used to pull data from the stream
+        metainfo: Metadata from the stream
+        dtype: NumPy type of the stream's channel format (None for strings)
+    """
+
+    def __init__(self, **stream_info):
+        self.connect(**stream_info)
+
+    def connect(self, **stream_info):
+        """
+        This method connects to a LSL data stream. It accepts keyword arguments that define
+        the data stream we are searching. Normally this would be (use keywords given between 
+        quotes as key for the argument) "name" (e.g. "Cognionics Quick-20"), "type" (e.g. "EEG"),
+        "channels" (e.g. 8), "freq" (from frequency, e.g. 500), "dtype" (type of data, e.g. 
+        "float32"), "serialn" (e.g. "quick_20").
+
+        After receiving the information of the stream, the script searches for it in the network
+        and resolves it, and then connects to it (or the first one in case there are many, that's
+        the reason why one has to be as specific as possible if many instances of LSL are being used
+        in the lab). It prints some of the metadata of the data stream to the screen so the user
+        can check if it is right, and returns the inlet to be used in other routines.
+
+        INPUT:
+            **kwargs: Keyword arguments defining the data stream
+
+        RELATED ATTRIBUTES:
+            streams, inlet, metainfo
+        """
+        # Put the known information of the stream in a tuple. It is better to know as much
+        # as possible if more than one kit is running LSL at the same time.
+        stream_info_list = []
+        for key, val in stream_info.items():
+            stream_info_list.append(key)
+            stream_info_list.append(val)
+
+        # Resolve the stream from the lab network
+        self.streams = resolve_stream(*stream_info_list)
+
+        # Create a new inlet to read from the stream
+        self.inlet = StreamInlet(self.streams[0])
+
+        # Get stream information (including custom meta-data) and break it down
+        self.metainfo = self.inlet.info()
+        self.dtype = LSL_DTYPES.get(self.metainfo.channel_format())
+
+        # Destination arrays of chunk_array, allocated on the first pull
+        self._chunk_data = None
+        self._chunk_stamps = None
+
+    def pull(self, **kwargs):
+        """
+        This method pulls data from the connected stream (using more information 
+        for the pull as given by kwargs).
+
+        INPUT:
+            kwargs: Extra specifications for the data pull from the stream
+
+        OUTPUT:
+            the data from the stream
+        """
+        # Retrieve data from the data stream
+        return self.inlet.pull_sample(**kwargs)
+
+    def chunk(self, **kwargs):
+        """
+        This method pulls chunks. Uses sames formating as .pull
+        """
+        # chunk, timestamp = self.inlet.pull_chunk(**kwargs)
+        with profiler.span("stream.chunk"):
+            chunk = self.inlet.pull_chunk(**kwargs)
+        profiler.count("stream.samples", len(chunk[1]))
+        return chunk
+
+    def chunk_array(self, max_samples=1024, timeout=0.0):
+        """
+        This method pulls chunks straight into a preallocated (max_samples x channels)
+        array using the dest_obj argument of pylsl, so no nested lists are built. The
+        same arrays are reused in every call, which means that the returned views are
+        only valid until the next pull (copy them, or add them to a LslBuffer, to keep
+        the data).
+
+        INPUT:
+            max_samples: Maximum number of samples pulled in this call
+            timeout: Time (s) to wait for samples. Default is 0 (just take what's there)
+
+        OUTPUT:
+            data: View of shape (samples received x channels)
+            stamps: View with the timestamps of those samples
+        """
+        if self.dtype is None:
+            raise TypeError("Only numeric streams can be pulled into arrays")
+
+        # Allocate the destination arrays again only if the size changes
+        if self._chunk_stamps is None or len(self._chunk_stamps) != max_samples:
+            self._chunk_data = np.zeros(
+                (max_samples, self.inlet.channel_count), dtype=self.dtype)
+            self._chunk_stamps = np.zeros(max_samples, dtype=np.float64)
+
+        # The samples are written in place, pylsl only gives back the timestamps
+        with profiler.span("stream.chunk"):
+            _, stamps = self.inlet.pull_chunk(timeout=timeout, max_samples=max_samples,
+                                              dest_obj=self._chunk_data)
+        received = len(stamps)
+        profiler.count("stream.samples", received)
+        self._chunk_stamps[:received] = stamps
+
+        return self._chunk_data[:received], self._chunk_stamps[:received]
+
+
+class LslBuffer(object):
+    """
+    This class works like a buffer, or an enhanced list to store data temporally.
+    It also stores the data in files when erasing it so you don't lose it but 
+    you don't lose RAM either.
+
+    When a capacity is given the buffer works as a fixed size ring buffer instead
+    of a list. The data (float32 by default) and the timestamps (float64, because
+    LSL stamps lose too much precision in float32) are kept in two preallocated
+    arrays that are written twice (at i and i + capacity), so any run of the last
+    samples is contiguous in memory and can be returned as a view without copying.
+    The ring buffer is guarded by a condition (self.lock), so it can be filled
+    from an acquisition thread (LslAcquisition) while it is queried elsewhere.
+
+    METHODS:
+        __init__: Create the buffer (as a list or, given a capacity, as a ring)
+        add: Add data from LSL stream (formatted as such)
+        take_old: Obtain the oldest part of data and erase it from the buffer
+        take_new: Obtain the newest part of data and erase it from the buffer
+        last: Views of the data and timestamps of the last samples (ring only)
+        between: Views of the data and timestamps in a time range (ring only)
+        wait_until: Block until a sample with a given timestamp arrives (ring only)
+        flag: Return a bool value indicating if the buffer has a certain size
+        clear: Clear the buffer
+        save: Save certain buffer data to a file
+        zip: Take all the files saved and put them into a single .npz file
+
+
+    ATTRIBUTES:
+        self.items: A list with the data and the timestamps as the last column
+            (None when working as a ring buffer)
+        self.save_names: A list with the names of the files used for saving
+        self.capacity: Maximum number of samples held (None for the list mode)
+        self.channels: Number of channels of the ring buffer
+        self.recorder: SessionRecorder every added chunk is written to (or None)
+        self.filterbank: FilterBank applied to the chunks added to the ring buffer
+            (or None). The recorder still gets the raw data.
+    """
+
+    def __init__(self, capacity=None, channels=None, dtype="float32", recorder=None,
+                 filterbank=None):
+        self.save_names = []    # A string with the names of the savefiles
+        self.recorder = recorder
+        self.filterbank = filterbank
+        self.capacity = capacity
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+
+        if capacity is None:
+            self.items = []
+        else:
+            self.items = None
+            self._head = 0      # Position of the next write, in [0, capacity)
+            self._count = 0     # Number of valid samples in the ring
+            self._data = None
+            self._stamps = None
+            self.lock = threading.Condition()
+            if channels is not None:
+                self._allocate(channels)
+
+    def __len__(self):
+        if self.capacity is None:
+            return len(self.items)
+        return self._count
+
+    def _allocate(self, channels):
+        # Twice the capacity so every window of valid samples is contiguous
+        self.channels = channels
+        self._data = np.zeros((2 * self.capacity, channels), dtype=self.dtype)
+        self._stamps = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def add(self, new):
+        data = new[0]
+        stamps = new[1]
+
+        # Everything that goes through the buffer also goes to the session file
+        if self.recorder is not None:
+            self.recorder.write(data, stamps)
+
+        if self.capacity is not None:
+            # Delay from the oldest sample of the chunk (its timestamp) until it is stored
+            if profiler.enabled and len(stamps):
+                profiler.record("buffer.sample_delay", stamps[0])
+                profiler.count("buffer.samples", len(stamps))
+            with profiler.span("buffer.add"), self.lock:
+                self._add_ring(data, stamps)
+                self.lock.notify_all()
+            return
+
+        for i in range(len(data)):  # Runs over all the moments (time points)
+            # Timestamps become another column on the list
+            data[i].append(stamps[i])
+
+        self.items.extend(data)
+
+    def _add_ring(self, data, stamps):
+        """ Vectorized insertion of a chunk in the ring buffer """
+        stamps = np.asarray(stamps, dtype=np.float64)
+        n = len(stamps)
+        if n == 0:
+            return
+        if self.filterbank is not None:
+            data = self.filterbank.process(np.asarray(data).reshape(n, -1))
+        data = np.asarray(data, dtype=self.dtype).reshape(n, -1)
+        if self._data is None:
+            self._allocate(data.shape[1])
+
+        # Only the last capacity samples of a huge chunk would survive anyway
+        cap = self.capacity
+        if n > cap:
+            data = data[-cap:]
+            stamps = stamps[-cap:]
+            self._head = (self._head + n - cap) % cap
+            n = cap
+
+        _ring_write(self._data, self._stamps, self._head, data, stamps)
+        self._head = (self._head + n) % cap
+        self._count = min(self._count + n, cap)
+
+    def _window(self, start, stop):
+        """ Views of the samples start:stop, counted from the oldest valid one """
+        if self._data is None:
+            return (np.zeros((0, self.channels or 0), dtype=self.dtype),
+                    np.zeros(0, dtype=np.float64))
+        first = self._head + self.capacity - self._count
+        return (self._data[first + start:first + stop],
+                self._stamps[first + start:first + stop])
+
+    def _table(self, start, stop):
+        """ Copy of the samples start:stop with the timestamps as last column """
+        data, stamps = self._window(start, stop)
+        return np.column_stack((data, stamps))
+
+    def last(self, ammount):
+        """
+        Return views (no copy) of the newest samples in the ring buffer.
+
+        INPUT:
+            ammount: Number of samples wanted (clipped to the samples held)
+
+        OUTPUT:
+            data: Array of shape (samples x channels)
+            stamps: Array with the timestamps of those samples
+
+        If the buffer is being filled from another thread, the views will be
+        overwritten once the ring goes around, so the capacity should be well
+        above the ammount of samples queried.
+        """
+        with self.lock:
+            ammount = min(ammount, self._count)
+            return self._window(self._count - ammount, self._count)
+
+    def between(self, t0, t1):
+        """
+        Return views (no copy) of the samples with timestamps in [t0, t1) held
+        in the ring buffer. The timestamps are expected to be increasing. Same
+        caveats as last() apply when the buffer is filled from another thread.
+        """
+        with self.lock:
+            _, stamps = self._window(0, self._count)
+            imin, imax = np.searchsorted(stamps, [t0, t1])
+            return self._window(imin, imax)
+
+    def wait_until(self, stamp, timeout=None):
+        """
+        Block until the newest sample in the ring buffer has a timestamp equal or
+        later than stamp, which means that every sample up to stamp has arrived.
+        Returns False if the timeout (s) runs out before that.
+        """
+        def arrived():
+            newest = self._head + self.capacity - 1
+            return self._count > 0 and self._stamps[newest] >= stamp
+
+        with self.lock:
+            return self.lock.wait_for(arrived, timeout)
+
+    def take_old(self, ammount, delete=False, **kwargs):
+        """ Take the oldest data in the buffer. Has an option to remove the
+        taken data from the buffer. """
+
+        # Save data to file
+        if "filename" in kwargs:
+            self.save(imax=ammount, filename=kwargs["filename"])
+        else:
+            self.save(imax=ammount)
+
+        if self.capacity is not None:
+            with self.lock:
+                return_ = self._table(0, min(ammount, self._count))
+                if delete == True:
+                    self._count -= len(return_)
+            return return_
+
+        # Delete data taken if asked
+        if delete == True:
+            return_ = self.items[:ammount]
+            self.items = self.items[ammount:]
+            return return_
+        else:
+            return self.items[:ammount]
+
+    def take_new(self, ammount, delete=False, **kwargs):
+        """ Take the newest data in the buffer. Has an option to remove the
+        taken data from the buffer. """
+
+        # Save data to file
+        if "filename" in kwargs:
+            self.save(imin=ammount, filename=kwargs["filename"])
+        else:
+            self.save(imin=ammount)
+
+        if self.capacity is not None:
+            with self.lock:
+                ammount = min(ammount, self._count)
+                return_ = self._table(self._count - ammount, self._count)
+                if delete == True:
+                    self._head = (self._head - ammount) % self.capacity
+                    self._count -= ammount
+            return return_
+
+        # Delete data taken if asked
+        if delete == True:
+            return_ = self.items[-ammount:]
+            self.items = self.items[:ammount]
+            return return_
+        else:
+            return self.items[-ammount:]
+
+    def flag(self, size):
+        # True if buffer bigger or equal than given size
+        return len(self) >= size
+
+    def clear(self, names=False):
+        if self.capacity is None:
+            self.items = []
+        else:
+            with self.lock:
+                self._head = 0
+                self._count = 0
+        if names == True:
+            self.save_names = []
+
+    def save(self, **kwargs):
+        """
+        Save part of the buffer to a .npy file 
+
+        Arguments:
+            imin (kwarg): First index of slice (arrays start with index 0)
+            imax (kwarg): Last index of slice (last item will be item imax-1)
+            filename (kwarg): Name of the file. Default is buffered_<date and time>
+            timestamped (kwarg): Whether or not to timestamp a custom filename. Default is True
+            tmin, tmax (kwarg): Time range to save instead of imin/imax (ring buffer only)
+        """
+
+        time_string = datetime.now().strftime("%y%m%d_%H%M%S%f")
+        if "filename" in kwargs:
+            if "timestamp" in kwargs and kwargs["timestamp"] == False:
+                file_name = kwargs["filename"]
+            else:
+                file_name = kwargs["filename"] + time_string
+        else:
+            file_name = "buffered_" + time_string
+
+        # Save the name to the list of names
+        self.save_names.append(file_name)
+
+        # The ring buffer is saved in the same (samples x channels + stamp) layout
+        if self.capacity is None:
+            items = self.items
+        elif "tmin" in kwargs or "tmax" in kwargs:
+            data, stamps = self.between(kwargs.get("tmin", -np.inf),
+                                        kwargs.get("tmax", np.inf))
+            items = np.column_stack((data, stamps))
+        else:
+            with self.lock:
+                items = self._table(0, self._count)
+
+        # Save data to file_name.npy file
+        if "imin" in kwargs and "imax" in kwargs:
+            imin = kwargs["imin"]
+            imax = kwargs["imax"]
+            np.save(file_name, items[imin:imax])
+        elif "imin" in kwargs:
+            imin = kwargs["imin"]
+            np.save(file_name, items[imin:])
+        elif "imax" in kwargs:
+            imax = kwargs["imax"]
+            np.save(file_name, items[:imax])
+        else:
+            np.save(file_name, items)
+
+    def zip(self, compress=False):
+        """
+        Takes all the saved .npy files and turns them into a
+        zipped (and compressed if compress = True) .npz file.
+
+        Arguments:
+            compress: True if want to use compressed version of
+                zipped file.
+        """
+        arrays = []
+        for name in self.save_names:
+            arrays.append(np.load(name + ".npy"))
+            os.remove(name + ".npy")
+
+        if compress == False:
+            np.savez(self.save_names[0], *arrays)
+        else:
+            np.savez_compressed(self.save_names[0], *arrays)
+
+
+class SessionRecorder(object):
+    """
+    Append-only recorder of a whole session of a stream in a single file. Every sample
+    is stored as a record with its timestamp, the trial and sequence markers at that
+    moment and the data of all the channels. The writing is done by a background thread,
+    so write() only has to copy the samples and queue them, and nothing is ever read
+    back or rewritten while recording.
+
+    The records go to <filename>.dat and the description of the records to
+    <filename>.json, so the session can be memory mapped (load) while it is still
+    being written or after it is finished without loading it into RAM.
+
+    METHODS:
+        __init__(filename, channels, srate): Create the files and start the writer
+        mark(trial, sequence, stamp): Set the markers of samples from stamp on
+        write(data, stamps): Queue a chunk of samples to be written
+        close: Write the queued samples and close the file
+        load(filename): Memory map a recorded session (static method)
+
+    ATTRIBUTES:
+        self.filename: Name of the session files (without extension)
+        self.dtype: NumPy dtype of the records (stamp, trial, sequence, data)
+        self.written: Number of samples written to the file so far
+    """
+
+    def __init__(self, filename, channels, srate=0):
+        self.filename = filename
+        self.dtype = SessionRecorder.record_dtype(channels)
+        self.written = 0
+
+        # Marker changes, as a (stamps, [trial, sequence] values) tuple of arrays. The
+        # tuple is replaced as a whole, so write() (called from the acquisition thread)
+        # never sees the arrays with different lengths
+        self._marks = (np.zeros(0), np.zeros((0, 2), dtype=np.int32))
+
+        # Description of the records, to be able to map the file later
+        with open(filename + ".json", "w") as header:
+            json.dump({"channels": channels, "srate": srate,
+                       "dtype": np.lib.format.dtype_to_descr(self.dtype)}, header)
+
+        self._file = open(filename + ".dat", "ab")
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def record_dtype(channels):
+        return np.dtype([("stamp", np.float64), ("trial", np.int32),
+                         ("sequence", np.int32), ("data", np.float32, (channels,))])
+
+    def mark(self, trial, sequence, stamp=None):
+        """ Samples with a timestamp equal or later than stamp (now by default) will
+        be recorded with these trial and sequence markers """
+        if stamp is None:
+            stamp = local_clock()
+        mark_stamps, mark_values = self._marks
+        self._marks = (np.append(mark_stamps, stamp),
+                       np.vstack((mark_values, [trial, sequence])))
+
+    def write(self, data, stamps):
+        """ Queue a chunk (data and its timestamps) to be written by the writer thread """
+        stamps = np.asarray(stamps, dtype=np.float64)
+        if len(stamps) == 0:
+            return
+
+        # The chunk is copied into the records, so the caller can reuse its arrays
+        records = np.empty(len(stamps), dtype=self.dtype)
+        records["stamp"] = stamps
+        records["data"] = np.asarray(data).reshape(len(stamps), -1)
+
+        # Markers of the last change before each sample (0 before the first one)
+        mark_stamps, mark_values = self._marks
+        if len(mark_stamps) == 0:
+            markers = np.zeros((len(stamps), 2), dtype=np.int32)
+        else:
+            index = np.searchsorted(mark_stamps, stamps, side="right") - 1
+            markers = np.where(index[:, None] >= 0, mark_values[np.maximum(index, 0)], 0)
+        records["trial"] = markers[:, 0]
+        records["sequence"] = markers[:, 1]
+
+        self._queue.put(records)
+
+    def _write_loop(self):
+        while True:
+            records = self._queue.get()
+            if records is None:
+                break
+            self._file.write(records.tobytes())
+            self.written += len(records)
+
+            # Flush when the queue is empty, so readers see the data soon
+            if self._queue.empty():
+                self._file.flush()
+
+    def close(self):
+        """ Wait for the queued samples to be written and close the file """
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    @staticmethod
+    def load(filename):
+        """
+        Memory map a recorded session (read only, so nothing is loaded into RAM).
+
+        INPUT:
+            filename: Name of the session files (without extension)
+
+        OUTPUT:
+            Record array with the fields "stamp", "trial", "sequence" and "data"
+                (the last one of shape samples x channels)
+        """
+        with open(filename + ".json") as header:
+            dtype = np.dtype(np.lib.format.descr_to_dtype(json.load(header)["dtype"]))
+
+        # Only whole records, in case the session is still being written
+        samples = os.path.getsize(filename + ".dat") // dtype.itemsize
+        if samples == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename + ".dat", dtype=dtype, mode="r", shape=(samples,))
+
+
+class LslAcquisition(threading.Thread):
+    """
+    Thread that keeps pulling data from one or several LSL streams into their ring
+    buffers (LslBuffer with a capacity), so the data is drained from the outlets
+    while the main thread is busy (for example, blocked by PsychoPy presenting the
+    stimuli). The main thread then only has to ask the buffers for the samples
+    between two timestamps.
+
+    The pulls are done with LslStream.chunk_array, so the streams used by this
+    thread should not be pulled from anywhere else while it is running.
+
+    METHODS:
+        __init__(pairs, max_samples, interval, clocksync): Set up the thread
+        run: Loop pulling every stream into its buffer (called by start())
+        stop: Ask the thread to finish and wait for it
+
+    ATTRIBUTES:
+        self.pairs: List of (LslStream, LslBuffer) tuples
+        self.max_samples: Maximum number of samples per pull
+        self.interval: Time (s) slept when all the streams were drained
+        self.clocksync: Whether to map the timestamps to the local clock
+    """
+
+    def __init__(self, pairs, max_samples=1024, interval=0.002, clocksync=True):
+        super().__init__(daemon=True)
+        self.pairs = pairs
+        self.max_samples = max_samples
+        self.interval = interval
+        self.clocksync = clocksync
+        self._running = threading.Event()
+
+    def run(self):
+        self._running.set()
+        while self._running.is_set():
+            drained = True
+            for stream, buffer in self.pairs:
+                data, stamps = stream.chunk_array(max_samples=self.max_samples)
+                if self.clocksync and len(stamps):
+                    # The stamps are in the clock of the sender
+                    stamps += stream.inlet.time_correction()
+                buffer.add((data, stamps))
+
+                # A full pull means there might be more samples waiting
+                if len(stamps) == self.max_samples:
+                    drained = False
+
+            if drained:
+                time.sleep(self.interval)
+
+    def stop(self, timeout=None):
+        self._running.clear()
+        self.join(timeout)
+
+
+class SharedBuffer(object):
+    """
+    Ring buffer in shared memory (multiprocessing.shared_memory) written by a single
+    process and read by any number of others (see SharedReader), so the samples of a
+    stream can be used by several processes without pulling the stream again and
+    without copying or pickling them.
+
+    The layout is the same as the ring of LslBuffer: data and timestamps are written
+    twice (at i and i + capacity), so any run of the last samples is contiguous. The
+    block starts with a header holding the total number of samples written, which is
+    only updated once the samples are in place, so readers never need a lock: they
+    read that counter and take the samples below it. The samples are written in
+    pieces of at most chunk samples, which overwrite the oldest ones of the ring
+    while the counter still includes them, so the readers only use the newest
+    capacity - chunk samples. A reader falling further behind loses the samples
+    overwritten.
+
+    METHODS:
+        __init__(capacity, channels, dtype, name, chunk): Create the shared memory block
+        add(new): Write a (data, stamps) chunk (same as LslBuffer.add, so it can be
+            filled by LslAcquisition)
+        close(unlink): Stop writing (readers see it) and release the block
+
+    ATTRIBUTES:
+        self.name: Name of the shared memory block, to attach the readers
+        self.capacity: Number of samples of the ring
+        self.chunk: Largest number of samples written at once
+        self.channels: Number of channels
+        self.dtype: NumPy type of the data
+        self.written: Total number of samples written
+    """
+
+    # Header: written, capacity, channels, closed, chunk (int64) and the dtype (string)
+    header_dtype = np.dtype([("written", np.int64), ("capacity", np.int64),
+                             ("channels", np.int64), ("closed", np.int64),
+                             ("chunk", np.int64), ("dtype", "S24")])
+
+    def __init__(self, capacity, channels, dtype="float32", name=None, chunk=None):
+        # A quarter of the ring by default
+        chunk = max(capacity // 4, 1) if chunk is None else chunk
+        if not 0 < chunk < capacity:
+            raise ValueError("The chunk of a SharedBuffer must be smaller than its capacity")
+        dtype = np.dtype(dtype)
+        size = SharedBuffer.block_size(capacity, channels, dtype)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._shm.name
+        self._header, self._data, self._stamps = SharedBuffer.map(
+            self._shm, capacity, channels, dtype)
+        self._header["capacity"] = capacity
+        self._header["channels"] = channels
+        self._header["chunk"] = chunk
+        self._header["dtype"] = dtype.str.encode()
+        self.capacity = capacity
+        self.chunk = chunk
+        self.channels = channels
+        self.dtype = dtype
+
+    @staticmethod
+    def block_size(capacity, channels, dtype):
+        data_size = 2 * capacity * channels * np.dtype(dtype).itemsize
+        # The timestamps start aligned to 8 bytes, after the header and the data
+        return 64 + int(np.ceil(data_size / 8)) * 8 + 2 * capacity * 8
+
+    @staticmethod
+    def map(shm, capacity, channels, dtype):
+        """ Arrays (header, data and stamps) on the memory of a shared block """
+        header = np.ndarray((), dtype=SharedBuffer.header_dtype, buffer=shm.buf)
+        data = np.ndarray((2 * capacity, channels), dtype=dtype, buffer=shm.buf,
+                          offset=64)
+        stamps_offset = 64 + int(np.ceil(data.nbytes / 8)) * 8
+        stamps = np.ndarray(2 * capacity, dtype=np.float64, buffer=shm.buf,
+                            offset=stamps_offset)
+        return header, data, stamps
+
+    @property
+    def written(self):
+        return int(self._header["written"])
+
+    def __len__(self):
+        return min(self.written, self.capacity - self.chunk)
+
+    def add(self, new):
+        data, stamps = new[0], np.asarray(new[1], dtype=np.float64)
+        n = len(stamps)
+        if n == 0:
+            return
+        data = np.asarray(data).reshape(n, -1)
+
+        # Only the last capacity samples of a huge chunk would survive anyway
+        cap = self.capacity
+        written = self.written
+        if n > cap:
+            data, stamps = data[-cap:], stamps[-cap:]
+            written += n - cap
+            n = cap
+
+        # Write in pieces of at most chunk samples, so the samples the readers use are
+        # never the ones being overwritten
+        for piece in range(0, n, self.chunk):
+            piece_data = data[piece:piece + self.chunk]
+            piece_stamps = stamps[piece:piece + self.chunk]
+            _ring_write(self._data, self._stamps, written % cap, piece_data, piece_stamps)
+
+            # Publish the samples once they are all in place
+            written += len(piece_stamps)
+            self._header["written"] = written
+
+    def close(self, unlink=True):
+        """ Mark the buffer as closed for the readers and release the block (and
+        destroy it with unlink, once every reader is done) """
+        self._header["closed"] = 1
+        self._header = self._data = self._stamps = None
+        self._shm.close()
+        if unlink:
+            # A reader sharing this resource tracker (before Python 3.13) unregistered
+            # the block already, register it again so unlink finds it
+            if os.name == "posix":
+                resource_tracker.register(self._shm._name, "shared_memory")
+            self._shm.unlink()
+
+
+class SharedReader(object):
+    """
+    Reader of a SharedBuffer from any process. It maps the shared block (nothing is
+    copied) and keeps its own read cursor, so each reader gets every sample once with
+    read() at its own pace, or just looks at the last samples with last().
+
+    Only the newest capacity - chunk samples of the ring are held (the oldest chunk
+    can be being overwritten). The arrays returned are views of the shared block:
+    they are valid until the writer writes over them (at least chunk samples later),
+    so they should be used (or copied) before that.
+
+    METHODS:
+        __init__(name, start): Attach to the shared buffer with that name, reading
+            from the next sample written (start="now") or the oldest one held
+            ("oldest"). The block is never destroyed by the reader
+        read(max_samples): Views of the samples after the cursor, moving it forward
+        last(ammount, copy): Views of the newest samples (the cursor is not moved),
+            or copies that are taken again if the writer reached them meanwhile
+        between(t0, t1, copy): Views (or copies) of the samples with timestamps in
+            [t0, t1)
+        wait(timeout): Block until there are samples after the cursor
+        close: Detach from the shared buffer
+
+    ATTRIBUTES:
+        self.name, self.capacity, self.chunk, self.channels, self.dtype: As in the
+            SharedBuffer
+        self.cursor: Index (total count) of the next sample read() will return
+        self.overruns: Samples lost because the writer got a capacity ahead
+        self.closed: Whether the writer has closed the buffer
+    """
+
+    def __init__(self, name, start="now"):
+        # The block belongs to the writer: the readers should not destroy it on exit
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13 registers every attach in the resource tracker
+            self._shm = shared_memory.SharedMemory(name=name)
+            if os.name == "posix":
+                resource_tracker.unregister(self._shm._name, "shared_memory")
+        self.name = name
+
+        header = np.ndarray((), dtype=SharedBuffer.header_dtype, buffer=self._shm.buf)
+        self.capacity = int(header["capacity"])
+        self.chunk = int(header["chunk"])
+        self.channels = int(header["channels"])
+        self.dtype = np.dtype(header["dtype"].item().decode())
+        self._header, self._data, self._stamps = SharedBuffer.map(
+            self._shm, self.capacity, self.channels, self.dtype)
+
+        # Read from the next sample written, or from the oldest one held
+        self.cursor = self.written if start == "now" else self.written - len(self)
+        self.overruns = 0
+
+    @property
+    def written(self):
+        return int(self._header["written"])
+
+    @property
+    def closed(self):
+        return bool(self._header["closed"])
+
+    def __len__(self):
+        return min(self.written, self.capacity - self.chunk)
+
+    def _window(self, start, stop):
+        """ Views of the samples with indexes (total counts) start:stop """
+        first = start % self.capacity
+        return (self._data[first:first + stop - start],
+                self._stamps[first:first + stop - start])
+
+    def read(self, max_samples=None):
+        """
+        Views of the samples written since the last read (at most max_samples),
+        moving the cursor after them.
+
+        OUTPUT:
+            data: Array of shape (samples x channels)
+            stamps: Array with the timestamps of those samples
+        """
+        written = self.written
+        held = self.capacity - self.chunk
+        if written - self.cursor > held:
+            # The oldest unread samples have been overwritten already
+            self.overruns += written - held - self.cursor
+            self.cursor = written - held
+        stop = written if max_samples is None else min(written, self.cursor + max_samples)
+        data, stamps = self._window(self.cursor, stop)
+        self.cursor = stop
+        return data, stamps
+
+    def _intact(self, start):
+        """ Whether the samples from start on have not been written over (yet) """
+        return self.written + self.chunk <= start + self.capacity
+
+    def last(self, ammount, copy=False):
+        """ Views (or copies, checked to be complete) of the newest ammount samples """
+        while True:
+            written = self.written
+            ammount = min(ammount, written, self.capacity - self.chunk)
+            data, stamps = self._window(written - ammount, written)
+            if not copy:
+                return data, stamps
+
+            # Copy again if the writer reached the samples while they were copied
+            data, stamps = data.copy(), stamps.copy()
+            if self._intact(written - ammount):
+                return data, stamps
+
+    def between(self, t0, t1, copy=False):
+        """ Views (or copies, checked to be complete) of the samples in [t0, t1) """
+        while True:
+            written = self.written
+            start = written - min(written, self.capacity - self.chunk)
+            _, stamps = self._window(start, written)
+            imin, imax = np.searchsorted(stamps, [t0, t1])
+            data, stamps = self._window(start + imin, start + imax)
+            if not copy:
+                return data, stamps
+
+            # The search and the copy are only valid if the samples were not overwritten
+            data, stamps = data.copy(), stamps.copy()
+            if self._intact(start):
+                return data, stamps
+
+    def wait(self, timeout=None, interval=0.001):
+        """ Wait until there are unread samples (True) or the timeout (s) runs out
+        or the buffer is closed (False) """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.written == self.cursor:
+            if self.closed or (deadline is not None and time.perf_counter() > deadline):
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self):
+        """ Detach from the shared buffer. The views returned can't be used after """
+        self._header = self._data = self._stamps = None
+        self._shm.close()
+
+
+class LslAcquisitionProcess(multiprocessing.Process):
+    """
+    Process that owns the LSL inlets and keeps pulling them into SharedBuffers, so
+    every other process (the stimulus presentation, classification, plotting...)
+    reads the samples with a SharedReader instead of connecting to the streams. In
+    the process, the pulls are done by a LslAcquisition thread.
+
+    The streams are given as the keyword arguments of LslStream (the inlets can't be
+    sent to another process) and the buffers are created in the acquisition process,
+    once the number of channels and type of each stream is known.
+
+    METHODS:
+        __init__(queries, seconds, max_samples, interval, clocksync): Set up the process
+        run: Connect, create the buffers and pull until stopped (called by start())
+        readers(timeout): Wait for the buffers and attach a SharedReader to each one
+        stop: Ask the process to finish (the buffers are destroyed) and wait for it
+
+    ATTRIBUTES:
+        self.queries: List of dictionaries with the LslStream keyword arguments
+        self.seconds: Duration of the samples held by each buffer
+        self.info: List with the buffer name and nominal rate of each stream (once
+            readers has been called)
+    """
+
+    def __init__(self, queries, seconds=60, max_samples=1024, interval=0.002,
+                 clocksync=True):
+        super().__init__(daemon=True)
+        self.queries = queries
+        self.seconds = seconds
+        self.max_samples = max_samples
+        self.interval = interval
+        self.clocksync = clocksync
+        self.info = None
+        self._ready = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+
+    def run(self):
+        streams = [LslStream(**query) for query in self.queries]
+        buffers = []
+        for stream in streams:
+            srate = stream.metainfo.nominal_srate()
+            capacity = int(np.ceil(self.seconds * (srate or 1000)))
+            # A pull is never bigger than max_samples (if the ring can hold that)
+            buffers.append(SharedBuffer(capacity, stream.inlet.channel_count,
+                                        stream.dtype,
+                                        chunk=min(self.max_samples, capacity // 2)))
+        self._ready.put([(buffer.name, stream.metainfo.nominal_srate())
+                         for buffer, stream in zip(buffers, streams)])
+
+        acquisition = LslAcquisition(list(zip(streams, buffers)), self.max_samples,
+                                     self.interval, self.clocksync)
+        acquisition.start()
+        self._stop.wait()
+        acquisition.stop()
+        for buffer in buffers:
+            buffer.close()
+
+    def readers(self, timeout=None):
+        """ Wait until the streams are connected and return a SharedReader of each one """
+        if self.info is None:
+            self.info = self._ready.get(timeout=timeout)
+        return [SharedReader(name) for name, _ in self.info]
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.join(timeout)
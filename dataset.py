@@ -0,0 +1,221 @@
+# General imports
+import numpy as np
+import os
+import shutil
+import hashlib
+
+# Custom imports
+from functions import preprocess_erp
+
+
+class ERPDataset(object):
+    """
+    ERP Dataset used to train and test machine learning models for BCI speller experiments.
+    It works as a map-style dataset of pytorch (__getitem__ and __len__ are overriden), so it can
+    be given to a DataLoader, but it doesn't subclass torch's Dataset to not import torch with it.
+    The dataset is from C. Guger et al. "How many people are able to control a P300-based brain-
+    computer interface (BCI)?"
+
+    This data is found in .mat files. For that, the library io from scipy is used. That gives us
+    some really nasty looking objects that we further transform into numpy arrays. Inside those data,
+    there are arrays meant for the training and arrays meant for the testing already prepared. After
+    separating those, we further separate the arrays into the features, the row-column indicators
+    (that tell us which of the row or columns in the speller's interface is being augmented) and the
+    target labels, that tells us wether or not that row/column was the one the user was looking at 
+    (and, therefore, if there is a P300 in that chunk of data).
+
+    After separation in these three arrays, further processing is done. Features according to the same
+    step in the experiment (during augmentation or inter-stimuli interval (ISI)) are put together to
+    create feature vectors with only one row/column indicator or one target label, which makes more
+    sense than having labels for each point in data that does not have any features that help identify
+    P300. Also, in each of these feature vectors all the channels are concatenated, so that we have
+    only one vector containing all the 9 channels. 
+
+    Apparently, there are arrays cointaining unimportant data before the start of each sequence. 
+    These arrays are first removed in what we called standarisation, that leaves us with feature arrays
+    just for the time during the augmentation and in the ISI. Then due to the nature of the P300, each
+    pair of augmentation and later ISI arrays are compacted into one array, which will be the feature
+    vector used for training and testing. This is called compacting.    
+
+    The preprocessed arrays can be cached on disk (cache_dir) as .npy files, so the next
+    time the same file is used they are memory mapped instead of parsing the .mat file
+    and preprocessing it again. Each cache entry is keyed by the path, size and
+    modification time of the .mat file and the preprocessing parameters, so changing any
+    of those makes a new entry. The entries of older versions of the file are removed
+    (the ones of other parameters are kept), and the least recently used entries are
+    evicted when the cache grows above cache_size bytes.
+
+    The feature vectors can also go through a FeatureExtractor (features), to get smaller
+    vectors (e.g. decimated) that make the models faster. Its parameters are part of the
+    cache key.
+
+    METHODS:
+        __init__(filepath, cache_dir, cache_size, features): Load the dataset (from cache
+            if possible)
+        load: Load the train and test arrays from the .mat file
+        preprocess: Preprocess the train and test arrays
+        params: Parameters of the preprocessing (part of the cache key)
+        load_cache: Memory map the arrays of the cache entry, if it exists
+        save_cache: Store the arrays in a new cache entry and evict outdated or old ones
+
+    ATTRIBUTES:
+        self.filepath: Path of the .mat file
+        self.cache_dir: Directory of the cache (None if not caching)
+        self.cache_size: Maximum size of the cache, in bytes
+        self.features: FeatureExtractor applied to the feature vectors (or None)
+        self.train_data: Dictionary with the features, rowcol and flags for training
+        self.test_data: Dictionary with the features, rowcol and flags for testing
+    """
+
+    # Bump this when the output of the preprocessing changes, to invalidate caches
+    cache_version = 1
+
+    # Channels of the EEG in the dataset
+    channels = 9
+
+    def __init__(self, filepath, cache_dir=None, cache_size=2**30, features=None):
+        self.filepath = filepath
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.features = features
+
+        # Memory map the cached arrays if they are there
+        if cache_dir is not None and self.load_cache():
+            return
+
+        # Use load method to load data
+        self.load(filepath)
+
+        # Use the process function
+        self.preprocess()
+
+        if cache_dir is not None:
+            self.save_cache()
+
+    def __getitem__(self, index):
+        """ Gives an item (feature vector and target flag) from the training data """
+        return self.train_data["features"][index], self.train_data["flags"][index]
+
+    def __len__(self):
+        # Number of feature vectors of the training data (the ones __getitem__ gives)
+        return len(self.train_data["flags"])
+
+    def load(self, filepath):
+        # Imported here, as it is only needed when the data is not in the cache
+        from scipy.io import loadmat
+
+        # This line is mainly to clean the format using only the filepath
+        data = loadmat(filepath)[os.path.splitext(os.path.basename(filepath))[0]][0, 0]
+
+        # Extract the train and test data from the void object
+        self.train_data = data["train"]
+        self.test_data = data["test"]
+
+    def preprocess(self):
+        # Use the preprocessing function on both sets of data
+        self.train_data = preprocess_erp(self.train_data)
+        self.test_data = preprocess_erp(self.test_data)
+
+        # Feature extraction from the (epochs x channels x samples) view of the vectors
+        if self.features is not None:
+            for data in (self.train_data, self.test_data):
+                epochs = data["features"].reshape(len(data["features"]), self.channels, -1)
+                data["features"] = self.features.transform(epochs)
+
+    def params(self):
+        """ Parameters that change the output of preprocess (part of the cache key) """
+        params = {"version": self.cache_version}
+        if self.features is not None:
+            params["features"] = repr(sorted(self.features.params().items()))
+        return params
+
+    def _cache_entry(self):
+        """ Name of the cache entry: hashes of the path, the file state and the params """
+        path = os.path.abspath(self.filepath)
+        stat = os.stat(path)
+        state = repr((stat.st_size, stat.st_mtime_ns))
+        params = repr(sorted(self.params().items()))
+        return "_".join(hashlib.sha1(part.encode()).hexdigest()[:16]
+                        for part in (path, state, params))
+
+    def load_cache(self):
+        """
+        Memory map (read only) the arrays of the cache entry of this file and parameters.
+        Returns False if there is no such entry, or if it is incomplete or corrupt (then
+        it is removed, so it is built again).
+        """
+        entry = os.path.join(self.cache_dir, self._cache_entry())
+        if not os.path.isdir(entry):
+            return False
+
+        # The entry can be missing files if another process is evicting it (or crashed
+        # while doing it)
+        try:
+            data = {}
+            for set_ in ("train", "test"):
+                data[set_] = {}
+                for key in ("features", "rowcol", "flags"):
+                    data[set_][key] = np.load(
+                        os.path.join(entry, "{0}_{1}.npy".format(set_, key)), mmap_mode="r")
+
+            # Mark the entry as recently used for the eviction
+            os.utime(entry)
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+
+        self.train_data, self.test_data = data["train"], data["test"]
+        return True
+
+    def save_cache(self):
+        """
+        Save the preprocessed arrays to a new cache entry, removing the entries of older
+        versions of the same file (with any parameters, as they can't be used anymore),
+        and evict the least recently used entries if the cache is too big.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_name = self._cache_entry()
+        entry = os.path.join(self.cache_dir, entry_name)
+
+        # Write in a temporary directory and rename it, so entries are never half written
+        temp = entry + ".tmp{0}".format(os.getpid())
+        os.makedirs(temp, exist_ok=True)
+        for set_ in ("train", "test"):
+            arrays = getattr(self, set_ + "_data")
+            for key in ("features", "rowcol", "flags"):
+                np.save(os.path.join(temp, "{0}_{1}.npy".format(set_, key)), arrays[key])
+        try:
+            os.rename(temp, entry)
+        except OSError:     # Another process saved the same entry first
+            shutil.rmtree(temp, ignore_errors=True)
+
+        # Entries of the same path with another file state are outdated, the ones with
+        # other parameters are still valid (e.g. several feature extractors of a file)
+        path_hash, state_hash, _ = entry_name.split("_")
+        for name in os.listdir(self.cache_dir):
+            parts = name.split("_")
+            if (".tmp" not in name and len(parts) == 3 and parts[0] == path_hash and
+                    parts[1] != state_hash):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+        self._evict(keep=entry_name)
+
+    def _evict(self, keep):
+        """ Remove the least recently used entries until the cache fits in cache_size """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if ".tmp" in name or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, name))
+
+        # Oldest first, but never the entry that was just saved
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.cache_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
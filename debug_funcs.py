@@ -3,48 +3,37 @@
 ## IMPORTS ##
 # General imports
 import numpy as np
-import scipy as sp
-import scipy.fftpack as fft
 import random as rand
 import time
+import glob
+import os
 import sys
+import json
+from scipy.io import loadmat
 
 # Networking imports
-from pylsl import StreamInfo, StreamOutlet, local_clock
+from pylsl import StreamInfo, StreamOutlet, local_clock, IRREGULAR_RATE
 
+# Custom imports
+from functions import preprocess_erp
+from acquisition import SessionRecorder
 
-def virtual_cognionics(channels=8, srate=500, chunk_size=1, buffer_size=360,
-                       stype="random"):
-    """ 
-    Here we create a data stream output so that we can test the rest of the networking
-    properties without having a proper output, like the one from Cognionics DAQ software.
-    This function will output random data to a number of channels given as an argument
-    (8 by default) at a given frequency in Hertz (500 by default).
 
-    For the purpose of being close to the actual cognionics signal, the data sent will be
-    formatted with metada as if it came from the actual cognionics headset. 5 more channels
-    are added normally appart from the channels for the sensors.
-
-    There are no required arguments for the function to work, but some keyword arguments
-    with default values exist in order for the function to be flexible.
+def cognionics_outlets(channels=8, srate=500, chunk_size=1, buffer_size=360):
+    """
+    Create the outlets of a virtual Cognionics Quick-20: the EEG stream and the
+    impedances stream, with the metadata of the CogDAQ software (channels + 5 streamed
+    channels, the 5 extra being accelerometers, packet counter and trigger).
 
     INPUT:
-        channels: The number of sensor that the supposed Cognionics EEG would have working
-        srate: The amount of samples sent per second
-        chunk_size: If the samples are going to be sent in chunks of data, then change this
-            number to how many samples per chunk
+        channels: The number of sensors of the virtual headset (above 8, the extra ones
+            are labelled EEG9, EEG10...)
+        srate: The nominal sampling rate of both streams
+        chunk_size: Samples per chunk of the outlets
         buffer_size: The size of the buffer (in x100 samples) that will hold the data
-        stype: "random", "sinusoid" or "noisy_sin" to choose which type of data will be 
-            sent (random is the default)
-
-    OUTPUT: There's no output.
 
-    IMPORTANT NOTE: When retrieving information from this stream remember that the data is pushed
-    just when there is a client, so there is no data immediately after a client connects, which will
-    in some cases, return an empty tuple if the client collects just after connecting.
-
-    SECOND IMPORTANT NOTE: time.sleep() can only do so much. Apparently for periods below 0.002s (roughly
-    500 Hz) the function starts behaving very wrong.
+    OUTPUT:
+        outlet, imp_outlet: The StreamOutlet of the EEG and of the impedances
     """
     # Here we define some metadata of the stream (Name, type, number of channels,
     # sample rate, data type and serial number/unique identifier).
@@ -53,8 +42,10 @@ def virtual_cognionics(channels=8, srate=500, chunk_size=1, buffer_size=360,
 
     # Attach some extra meta-data (accordance with XDF format)
     channels_handle = stream_info.desc().append_child("channels")
-    channels_labels = ["P8", "P7", "Pz", "P4", "P3", "O1", "O2", "A2",
-                       "ACC8", "ACC9", "ACC10", "Packet Counter", "TRIGGER"]
+    sensor_labels = ["P8", "P7", "Pz", "P4", "P3", "O1", "O2", "A2"]
+    sensor_labels += ["EEG{0}".format(i + 1) for i in range(len(sensor_labels), channels)]
+    channels_labels = sensor_labels[:channels] + ["ACC8", "ACC9", "ACC10",
+                                                  "Packet Counter", "TRIGGER"]
     for label in channels_labels:
         ch = channels_handle.append_child("channel")
         ch.append_child_value("label", label)
@@ -73,19 +64,100 @@ def virtual_cognionics(channels=8, srate=500, chunk_size=1, buffer_size=360,
         ch.append_child_value("type", "Impedance")
 
     # Here we create an outlet with our information, sending information in chunks of
-    # 1 sample and the outgoing buffer size being 360 seconds (max.)
+    # chunk_size samples and the outgoing buffer size being 360 seconds (max.)
     outlet = StreamOutlet(stream_info, chunk_size, buffer_size)
     imp_outlet = StreamOutlet(imp_stream_info, chunk_size, buffer_size)
 
+    return outlet, imp_outlet
+
+
+def signal_block(stype, channels, first, count, srate):
+    """
+    Generate a block of samples of the virtual Cognionics signals at once.
+
+    INPUT:
+        stype: "random", "sinusoid" or "noisy_sin" (see virtual_cognionics)
+        channels: Number of channels of the block
+        first: Index of the first sample of the block since the stream started
+        count: Number of samples of the block
+        srate: The sampling rate, to compute the time of each sample
+
+    OUTPUT:
+        Float32 array of shape (count x channels)
+    """
+    # Time of each sample of the block
+    step = (first + np.arange(count)) / srate
+
+    if stype == "random":
+        return np.random.rand(count, channels).astype(np.float32)
+
+    elif stype == "sinusoid":  # Frequency of 10 Hz
+        wave = np.sin(10 * 2 * np.pi * step)
+
+    elif stype == "noisy_sin":  # Frequencies of 5 and 15 Hz
+        wave = np.sin(5 * 2 * np.pi * step) + 0.2 * \
+            np.sin(15 * 2 * np.pi * step) + 0.2 * np.random.rand(count)
+    else:
+        raise TypeError(
+            "Wrong signal type. Please check documentation")
+
+    # Same value on every channel, as the sample by sample generator does
+    return np.repeat(wave.astype(np.float32)[:, None], channels, axis=1)
+
+
+def virtual_cognionics(channels=8, srate=500, chunk_size=1, buffer_size=360,
+                       stype="random", block=None):
+    """ 
+    Here we create a data stream output so that we can test the rest of the networking
+    properties without having a proper output, like the one from Cognionics DAQ software.
+    This function will output random data to a number of channels given as an argument
+    (8 by default) at a given frequency in Hertz (500 by default).
+
+    For the purpose of being close to the actual cognionics signal, the data sent will be
+    formatted with metada as if it came from the actual cognionics headset. 5 more channels
+    are added normally appart from the channels for the sensors.
+
+    There are no required arguments for the function to work, but some keyword arguments
+    with default values exist in order for the function to be flexible.
+
+    INPUT:
+        channels: The number of sensor that the supposed Cognionics EEG would have working
+        srate: The amount of samples sent per second
+        chunk_size: If the samples are going to be sent in chunks of data, then change this
+            number to how many samples per chunk
+        buffer_size: The size of the buffer (in x100 samples) that will hold the data
+        stype: "random", "sinusoid" or "noisy_sin" to choose which type of data will be 
+            sent (random is the default)
+        block: If given, the duration (in s) of the blocks generated and pushed at once
+            (see the chunked mode below). By default the samples are sent one by one
+
+    OUTPUT: There's no output.
+
+    IMPORTANT NOTE: When retrieving information from this stream remember that the data is pushed
+    just when there is a client, so there is no data immediately after a client connects, which will
+    in some cases, return an empty tuple if the client collects just after connecting.
+
+    SECOND IMPORTANT NOTE: time.sleep() can only do so much. Apparently for periods below 0.002s (roughly
+    500 Hz) the function starts behaving very wrong. For higher rates (or many channels) use the
+    chunked mode (e.g. block=0.01): whole blocks are generated as arrays and pushed with push_chunk,
+    scheduled against absolute deadlines of local_clock() so the effective rate stays exact (a late
+    wake up just makes the next block bigger). It holds 2 kHz with 64+ channels.
+    """
+    outlet, imp_outlet = cognionics_outlets(channels, srate, chunk_size, buffer_size)
+
     # Now here we create the samples and push them to the network
     print("Now sending data...")
-    t0, step = local_clock(), 0  # Used for the stamps and the sample signals
+    if block is not None:
+        push_blocks(outlet, imp_outlet, channels + 5, srate, block, stype)
+        return
+
+    step = 0  # Used for the sample signals
     interval = 1 / srate
     while True:
         # Only work if client connected
         if outlet.have_consumers():
-            # Get the timestamp with t0 as a reference for initial time
-            stamp = local_clock() - t0
+            # Get the timestamp (in the LSL clock, so clients can compare it to theirs)
+            stamp = local_clock()
 
             # Here we create the sample with random data
             if stype == "random":
@@ -113,14 +185,200 @@ def virtual_cognionics(channels=8, srate=500, chunk_size=1, buffer_size=360,
         time.sleep(interval)
 
 
+def push_blocks(outlet, imp_outlet, channels, srate, block, stype, duration=None):
+    """
+    Chunked mode of virtual_cognionics. The samples due since the stream started
+    (counted from local_clock, not from the sleeps) are generated as one array and
+    pushed with push_chunk, then the loop sleeps until the absolute deadline of the
+    next block. Sleeping late only makes the next block bigger, so the effective rate
+    does not drift. The clock restarts whenever the stream loses its consumers.
+
+    INPUT:
+        outlet, imp_outlet: The outlets of cognionics_outlets
+        channels: Number of channels streamed (sensors + 5)
+        srate: The sampling rate
+        block: Duration (in s) of the blocks
+        stype: "random", "sinusoid" or "noisy_sin"
+        duration: If given, stop after this many seconds of data (for load tests)
+
+    OUTPUT:
+        The number of samples sent
+    """
+    block_samples = max(int(round(block * srate)), 1)
+    start = None
+    sent = 0
+    total = 0
+    while duration is None or total < duration * srate:
+        # Only work if client connected
+        if not outlet.have_consumers():
+            start = None
+            time.sleep(block)
+            continue
+
+        # Samples are due from the moment the first consumer was found
+        now = local_clock()
+        if start is None:
+            start, sent = now, 0
+        count = int((now - start) * srate) + 1 - sent
+
+        if count > 0:
+            data = signal_block(stype, channels, sent, count, srate)
+
+            # Stamp of the last sample of the block (the rest are derived from srate)
+            stamp = start + (sent + count - 1) / srate
+            outlet.push_chunk(data, stamp)
+            if imp_outlet.have_consumers():
+                imp_outlet.push_chunk(data, stamp)
+            sent += count
+            total += count
+
+        # Wait until the deadline of the next block
+        deadline = start + (sent + block_samples - 1) / srate
+        time.sleep(max(deadline - local_clock(), 0))
+
+    return total
+
+
+def load_recording(filepath, set_="train"):
+    """
+    Load a recording to be replayed: a file of the BNCI dataset (Visual ERP BNCI/*.mat)
+    or a session recorded by acquisition.SessionRecorder (its .dat or .json file).
+
+    The channels are given as the Cognionics streams send them (sensors + 5): the 8
+    sensors of the BNCI files are followed by 3 accelerometers and a packet counter
+    (zeros) and the TRIGGER channel, which carries the rowcol indicator.
+
+    INPUT:
+        filepath: Path of the .mat file or of the session files
+        set_: "train" or "test", the set of the BNCI file replayed
+
+    OUTPUT:
+        data: Float32 array (samples x channels)
+        events: Int32 array (samples x 2) with the rowcol and flag indicators of the
+            BNCI files, or the trial and sequence markers of the sessions
+        srate: The sampling rate of the recording
+    """
+    if filepath.endswith(".mat"):
+        # Rows: time, 8 sensors, rowcol and flag (as described in functions.preprocess_erp)
+        mat = loadmat(filepath)
+        subject = os.path.splitext(os.path.basename(filepath))[0]
+        erp_array = mat[subject][0, 0][set_]
+        srate = 1 / (erp_array[0, 1] - erp_array[0, 0])
+
+        data = np.zeros((erp_array.shape[1], 13), dtype=np.float32)
+        data[:, :8] = erp_array[1:9].T
+        data[:, 12] = erp_array[9]
+        events = erp_array[9:11].T.astype(np.int32)
+
+    else:
+        filename = os.path.splitext(filepath)[0]
+        records = SessionRecorder.load(filename)
+        with open(filename + ".json") as header:
+            srate = json.load(header)["srate"]
+
+        # Streams without a nominal rate are replayed at their average rate
+        if not srate:
+            srate = (len(records) - 1) / (records["stamp"][-1] - records["stamp"][0])
+
+        data = np.asarray(records["data"], dtype=np.float32)
+        events = np.stack((records["trial"], records["sequence"]), axis=1)
+
+    return data, events, srate
+
+
+def replay_recording(filepath, set_="train", speed=1.0, block=0.02, loop=False,
+                     wait=True):
+    """
+    Replay a recording (see load_recording) as if it was a live Cognionics headset: the
+    channels are streamed at the original rate by the same outlets of virtual_cognionics
+    and the events (rowcol and flag, or trial and sequence) by a marker stream. A marker
+    is pushed for every sample where the events change to a non zero value (e.g. the
+    start of every flash of the BNCI files), with exactly the timestamp of that sample,
+    so markers and data are synchronized.
+    Each inlet applies its own clock correction, so a consumer looking up the sample of
+    a marker in the data should allow for half a sample of difference.
+
+    The samples are pushed in blocks against absolute deadlines of local_clock() (as
+    push_blocks does). With speed above 1 the recording is replayed faster than real
+    time: the timestamps are those of the moment each sample is sent, 1 / (srate *
+    speed) apart, while the number of samples per second of recording is the same, so
+    anything working in samples (e.g. processing.Epocher) behaves as with the original.
+
+    INPUT:
+        filepath: Path of the BNCI .mat file or of the session files
+        set_: "train" or "test", the set of the BNCI file replayed
+        speed: Factor of the replay rate over the original rate
+        block: Duration (in s, of replay time) of the blocks pushed
+        loop: Start again from the beginning when the recording ends
+        wait: Wait for a consumer of the data stream before starting the replay
+
+    OUTPUT:
+        The number of samples sent
+    """
+    data, events, srate = load_recording(filepath, set_)
+    outlet, imp_outlet = cognionics_outlets(data.shape[1] - 5, srate)
+    marker_info = StreamInfo("Virtual Cognionics Quick-20 Markers", "Markers", 2,
+                             IRREGULAR_RATE, "int32", "myuid000002")
+    marker_outlet = StreamOutlet(marker_info)
+
+    # Samples where a marker is pushed: the events change to a non zero value
+    changes = np.any(np.diff(events, axis=0) != 0, axis=1)
+    marker_index = np.flatnonzero(changes & np.any(events[1:] != 0, axis=1)) + 1
+    if np.any(events[0] != 0):
+        marker_index = np.concatenate(([0], marker_index))
+
+    if wait:
+        print("Waiting for a consumer...")
+        while not outlet.have_consumers():
+            time.sleep(0.1)
+
+    rate = srate * speed
+    block_samples = max(int(round(block * rate)), 1)
+    print("Now replaying {0} ({1} samples at {2} Hz, x{3})...".format(
+        filepath, len(data), srate, speed))
+
+    total = 0
+    while True:
+        start = local_clock()
+        sent = 0
+        next_marker = 0
+        while sent < len(data):
+            # Samples due since the replay started, in one block
+            count = min(int((local_clock() - start) * rate) + 1 - sent, len(data) - sent)
+            if count > 0:
+                stamps = start + (sent + np.arange(count)) / rate
+                # Stamp of every sample (LSL would derive them from the nominal rate)
+                outlet.push_chunk(data[sent:sent + count], stamps.tolist())
+                if imp_outlet.have_consumers():
+                    imp_outlet.push_chunk(data[sent:sent + count], stamps.tolist())
+
+                # Markers of the samples of the block, with their timestamps
+                last_marker = np.searchsorted(marker_index, sent + count)
+                for index in marker_index[next_marker:last_marker]:
+                    marker_outlet.push_sample(events[index].tolist(),
+                                              stamps[index - sent])
+                next_marker = last_marker
+                sent += count
+
+            # Wait until the deadline of the next block
+            deadline = start + (sent + block_samples - 1) / rate
+            time.sleep(max(deadline - local_clock(), 0))
+
+        total += sent
+        if not loop:
+            return total
+
+
 def process_rfft(time, signal):
     """ This function calculates the real fast Fourier transform of a given signal
     and exports the frequency and the signal as obtained in magnitude and in dB, all
-    in the same list.
+    in the same list. For continuous estimates while data arrives, use
+    processing.SpectralEstimator instead.
 
     INPUT:
         time: an iterable with the timestamps of the different values of the signal
-        signal: an iterable with the values of the signal
+        signal: an iterable with the values of the signal, or an array of shape
+            (samples x channels) to transform all the channels at once
 
     OUTPUT:
         LIST containing freq, fsignal and dBsignal
@@ -130,14 +388,225 @@ def process_rfft(time, signal):
             dBsignal: magnitude of the signal at the different frequencies, in dB
     """
 
-    freq = fft.fftfreq(len(time), time[1] - time[0])
-    fsignal = fft.rfft(signal)
+    # Frequencies of the bins of the real transform (same length as its output)
+    freq = np.fft.rfftfreq(len(time), time[1] - time[0])
+    fsignal = np.abs(np.fft.rfft(signal, axis=0))
 
     # Transform into dB
-    dBsignal = 20 * sp.log10(fsignal)
+    dBsignal = 20 * np.log10(fsignal)
 
     return [freq, fsignal, dBsignal]
 
 
+def preprocess_erp_loop(erp_array):
+    """ Former loop based implementation of functions.preprocess_erp. It is kept
+    as the reference the vectorized version is checked against (see
+    compare_preprocess_erp), please don't use it for anything else. """
+
+    features = []
+    rowcol = []
+    flags = []
+
+    # Cut the array every time the rowcol indicator changes
+    first_index = 0
+    for i in range(erp_array.shape[1]):
+        if i+1 == erp_array.shape[1] or erp_array[9, i] != erp_array[9, i+1]:
+            features.append(erp_array[0:9, first_index:i+1])
+            rowcol.append(erp_array[9, i])
+            flags.append(erp_array[10, i])
+            first_index = i+1
+
+    # Get rid of the baseline before the experiment
+    del(features[0])
+    del(rowcol[0])
+    del(flags[0])
+
+    # Standarise the lengths of the anomalous vectors
+    std_len_1 = features[0].shape[1]
+    std_len_2 = features[1].shape[1]
+    index = 0
+    while not index >= len(features):
+        iter_len = features[index].shape[1]
+        if iter_len != std_len_1 and iter_len != std_len_2:
+            if features[index-1].shape[1] == std_len_1:
+                features[index] = features[index][:, :std_len_2]
+            elif features[index-1].shape[1] == std_len_2:
+                features[index] = features[index][:, :std_len_1]
+        index += 1
+
+    # Compact every pair of vectors into one feature vector
+    iter_ = 0
+    while not iter_+1 >= len(features):
+        features[iter_] = np.append(
+            features[iter_], features[iter_ + 1], axis=1).flatten()
+        del(features[iter_ + 1])
+        del(rowcol[iter_ + 1])
+        del(flags[iter_ + 1])
+        iter_ += 1
+
+    return {"features": np.asarray(features), "rowcol": np.asarray(rowcol),
+            "flags": np.asarray(flags)}
+
+
+def compare_preprocess_erp(pattern="Visual ERP BNCI/*.mat", repeats=5):
+    """
+    Regression check and timing comparison of functions.preprocess_erp against the
+    former loop based implementation (preprocess_erp_loop) on the BNCI files.
+    Raises an AssertionError if any output differs.
+
+    INPUT:
+        pattern: Glob pattern of the .mat files to use
+        repeats: Number of times each implementation runs on each array (the best
+            time is reported)
+
+    OUTPUT:
+        List of (file, set, loop time, vectorized time) tuples, times in s
+    """
+    results = []
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        data = loadmat(path)[name][0, 0]
+
+        for set_ in ("train", "test"):
+            erp_array = data[set_]
+            reference = preprocess_erp_loop(erp_array)
+            output = preprocess_erp(erp_array)
+
+            # Same keys, shapes and values
+            for key in ("features", "rowcol", "flags"):
+                assert output[key].shape == reference[key].shape, (name, set_, key)
+                assert np.array_equal(output[key], reference[key]), (name, set_, key)
+
+            # Best time out of the repeats for each implementation
+            times = []
+            for func in (preprocess_erp_loop, preprocess_erp):
+                best = np.inf
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    func(erp_array)
+                    best = min(best, time.perf_counter() - start)
+                times.append(best)
+
+            results.append((name, set_, times[0], times[1]))
+            print("{0} {1}: loop {2:.4f} s, vectorized {3:.4f} s ({4:.1f}x)".format(
+                name, set_, times[0], times[1], times[0] / times[1]))
+
+    return results
+
+
+def check_window_processor(channels=4, window=10, hop=5):
+    """
+    Regression check of processing.WindowProcessor with the chunks a pull without
+    timeout gives: empty chunks (which have to give no windows instead of failing)
+    between chunks of several sizes. The windows processed have to be the same as
+    the ones cut from the whole signal. Raises an AssertionError if they differ.
+
+    INPUT:
+        channels: Number of channels of the signal
+        window: Samples per window
+        hop: Samples between the starts of consecutive windows
+
+    OUTPUT:
+        Number of windows checked
+    """
+    # Imported here, so the rest of the debug functions don't need SciPy's signal
+    from processing import WindowProcessor
+
+    signal = np.random.rand(100, channels).astype(np.float32)
+    stamps = np.arange(100, dtype=np.float64)
+    processor = WindowProcessor(lambda t, d: (t.copy(), d.copy()), window, hop=hop)
+
+    # An empty pull, as chunk_array gives it, before any sample has arrived
+    assert processor.push(np.zeros((0, channels), dtype=np.float32), np.zeros(0)) == []
+
+    outputs = []
+    edges = [0, 3, 3, 20, 21, 21, 60, 100]  # Repeated edges are empty chunks
+    for start, stop in zip(edges[:-1], edges[1:]):
+        outputs += processor.push(signal[start:stop], stamps[start:stop])
+
+    expected = range(0, 100 - window + 1, hop)
+    assert len(outputs) == len(expected)
+    for (t, d), start in zip(outputs, expected):
+        assert np.array_equal(t, stamps[start:start + window])
+        assert np.array_equal(d, signal[start:start + window])
+
+    print("WindowProcessor: {0} windows checked".format(len(outputs)))
+    return len(outputs)
+
+
+def compare_startup(modules=("main", "plot_main", "erp", "erp_benchmark", "debug_funcs"),
+                    repeats=5, top=5):
+    """
+    Startup time of the entry points: each one is imported (their experiments are
+    under __main__, so only the imports run) in a new interpreter, as when they are
+    launched, and the slowest imports are listed with python -X importtime.
+
+    INPUT:
+        modules: Names of the entry points (without .py)
+        repeats: Number of interpreters started for each one (the median is reported)
+        top: Number of slowest top level imports listed for each one
+
+    OUTPUT:
+        Dictionary with the median import time (s) of each entry point (None if some
+            of its dependencies are not installed)
+    """
+    import subprocess
+    code = "import time; start = time.perf_counter(); import {0}; " \
+           "print(time.perf_counter() - start)"
+
+    results = {}
+    for module in modules:
+        times = []
+        for _ in range(repeats):
+            run = subprocess.run([sys.executable, "-c", code.format(module)],
+                                 capture_output=True, text=True)
+            if run.returncode != 0:
+                break
+            times.append(float(run.stdout.split()[-1]))
+
+        if len(times) < repeats:
+            results[module] = None
+            print("{0}: could not be imported ({1})".format(
+                module, run.stderr.strip().splitlines()[-1]))
+            continue
+        results[module] = float(np.median(times))
+        print("{0}: {1:.3f} s".format(module, results[module]))
+
+        # Cumulative time of the imports done by the entry point itself
+        run = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                              "import " + module], capture_output=True, text=True)
+        imports = []
+        for line in run.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                name = fields[2]
+                # Top level imports are the ones with the least indentation
+                imports.append((len(name) - len(name.lstrip()), int(fields[1]),
+                                name.strip()))
+        if imports:
+            # The entry point itself is the last one, its direct imports are one level in
+            level = imports[-1][0] + 2
+            direct = sorted([(cumulative, name) for indent, cumulative, name in imports
+                             if indent == level], reverse=True)
+            for cumulative, name in direct[:top]:
+                print("    {0:<30}{1:>8.3f} s".format(name, cumulative / 1e6))
+
+    return results
+
+
 if __name__ == "__main__":
-    virtual_cognionics(stype=sys.argv[1], srate=float(sys.argv[2]))
+    # python debug_funcs.py startup
+    if sys.argv[1] == "startup":
+        compare_startup()
+        sys.exit()
+
+    # python debug_funcs.py replay filepath [speed] [set]
+    if sys.argv[1] == "replay":
+        replay_recording(sys.argv[2], speed=float(sys.argv[3]) if len(sys.argv) > 3 else 1.0,
+                         set_=sys.argv[4] if len(sys.argv) > 4 else "train", loop=True)
+        sys.exit()
+
+    # python debug_funcs.py stype srate [channels] [block]
+    virtual_cognionics(stype=sys.argv[1], srate=float(sys.argv[2]),
+                       channels=int(sys.argv[3]) if len(sys.argv) > 3 else 8,
+                       block=float(sys.argv[4]) if len(sys.argv) > 4 else None)
@@ -1,33 +1,36 @@
 ## IMPORT LIBRARIES ##
 import numpy as np
-import torch
-from classes import ERPDataset as ERP
+from dataset import ERPDataset as ERP
 import glob
-import sklearn
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
-from functions import dataset_probe, rowcol_paradigm
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functions import dataset_probe, rowcol_paradigm, dict_bash_kwargs
 import random
 
-## MAIN ##
-# First we are going to load every ERP data file
-erp_data_list = []
-path_list = glob.glob("Visual ERP BNCI\\*.mat")
-for file_ in path_list:
-    erp_data_list.append(ERP(file_))
 
-# Create a list containing the characters used in the speller
-chars = rowcol_paradigm()
+def evaluate_subject(file_, cache_dir="erp_cache"):
+    """
+    Load (and preprocess) the ERP data of one subject, train an LDA with its training
+    set and score it with its test set. It is a function on its own so it can be run
+    in the worker processes of the evaluation.
 
-# Create LDA
-lda = LDA(solver="lsqr", shrinkage="auto")
+    INPUT:
+        file_: Path to the .mat file of the subject
+        cache_dir: Directory of the ERPDataset cache
 
-# Score list
-train_data = []
-test_data = []
+    OUTPUT:
+        Dictionary with the subject's name, the score and the import (of scikit-learn),
+            load, fit and total (wall) times in seconds
+    """
+    # Imported here, so the script starts fast and only the workers import scikit-learn
+    # (the first subject of each worker pays for it, it is reported on its own)
+    start = time.perf_counter()
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
+    imported = time.perf_counter()
 
-# Load random dataset from the list and probe the training and test sets
-for i in range(len(erp_data_list)):
-    erp_set = erp_data_list[i]
+    erp_set = ERP(file_, cache_dir=cache_dir)
+    loaded = time.perf_counter()
 
     # Extract train and test sets
     trdat = erp_set.train_data
@@ -36,16 +39,39 @@ for i in range(len(erp_data_list)):
     tsdat = erp_set.test_data
     # dataset_probe(tsdat)
 
-    # Separate features, rowcol and flags
-    trfeat = trdat["features"]
-    trrc = trdat["rowcol"]
-    trflg = trdat["flags"]
+    # Train LDA and test it
+    lda = LDA(solver="lsqr", shrinkage="auto")
+    lda.fit(trdat["features"], trdat["flags"])
+    score = lda.score(tsdat["features"], tsdat["flags"])
+    end = time.perf_counter()
 
-    tsfeat = tsdat["features"]
-    tsrc = tsdat["rowcol"]
-    tsflg = tsdat["flags"]
+    return {"subject": os.path.splitext(os.path.basename(file_))[0], "score": score,
+            "import_time": imported - start, "load_time": loaded - imported,
+            "fit_time": end - loaded, "wall_time": end - start}
 
-    # Train LDA and test it
-    lda.fit(trfeat, trflg)
-    score = lda.score(tsfeat, tsflg)
-    print("Set {0}, score = {1}".format(path_list[i].split("\\")[-1].split(".")[-2], score))
+
+## MAIN ##
+if __name__ == "__main__":
+    # Number of worker processes (e.g. python erp.py workers=4), one per core by default
+    kwargs = dict_bash_kwargs()
+    workers = int(kwargs.get("workers", os.cpu_count()))
+
+    # Every ERP data file is loaded, trained and tested in its own process
+    path_list = sorted(glob.glob(os.path.join("Visual ERP BNCI", "*.mat")))
+
+    # Create a list containing the characters used in the speller
+    chars = rowcol_paradigm()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(evaluate_subject, path_list))
+    total = time.perf_counter() - start
+
+    # Print the scores as a table
+    print("{0:<10}{1:>8}{2:>12}{3:>12}{4:>12}{5:>12}".format(
+        "Set", "Score", "Import (s)", "Load (s)", "Fit (s)", "Wall (s)"))
+    for result in results:
+        print(("{subject:<10}{score:>8.4f}{import_time:>12.3f}{load_time:>12.3f}"
+               "{fit_time:>12.3f}{wall_time:>12.3f}").format(**result))
+    print("Mean score = {0:.4f}. Total wall time with {1} workers: {2:.3f} s".format(
+        np.mean([result["score"] for result in results]), workers, total))
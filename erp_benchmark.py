@@ -0,0 +1,175 @@
+## IMPORT LIBRARIES ##
+import numpy as np
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import scipy
+from dataset import ERPDataset as ERP
+from processing import OnlineLDA, FeatureExtractor
+from functions import dict_bash_kwargs
+
+
+def LDA(**kwargs):
+    """ scikit-learn's LinearDiscriminantAnalysis, imported when a model is built so
+    the script starts fast """
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+    return LinearDiscriminantAnalysis(**kwargs)
+
+
+# Models benchmarked, by name
+MODELS = {
+    "lda_lsqr_auto": lambda: LDA(solver="lsqr", shrinkage="auto"),
+    "lda_eigen_auto": lambda: LDA(solver="eigen", shrinkage="auto"),
+    "lda_svd": lambda: LDA(solver="svd"),
+    "online_lda_auto": lambda: OnlineLDA(shrinkage="auto"),
+}
+
+# Feature extraction settings benchmarked, by name
+FEATURES = {
+    "raw": FeatureExtractor(),
+    "decimate_2": FeatureExtractor(decimation=2),
+    "decimate_4": FeatureExtractor(decimation=4),
+    "mean_4": FeatureExtractor(window=4),
+    "decimate_2_mean_2": FeatureExtractor(decimation=2, window=2),
+}
+
+
+def extract(features, extractor):
+    """ Run the extractor on the feature vectors of the ERPDataset """
+    features = np.asarray(features)
+    return extractor.transform(features.reshape(len(features), ERP.channels, -1))
+
+
+def benchmark_pipeline(erp_set, model_name, features_name, single_repeats=200):
+    """
+    Fit and test one pipeline (feature extraction + model) on a subject, measuring
+    its cost.
+
+    INPUT:
+        erp_set: The ERPDataset of the subject
+        model_name: Key of the model in MODELS
+        features_name: Key of the feature extraction in FEATURES
+        single_repeats: Number of single epoch predictions timed
+
+    OUTPUT:
+        Dictionary with the accuracy, balanced accuracy, ROC AUC, fit time (s), single
+            epoch latency (median and 95th percentile, in ms), batch throughput
+            (epochs/s) and peak memory (MB)
+    """
+    # Imported here, so the script starts fast (as the models)
+    from sklearn.metrics import balanced_accuracy_score, roc_auc_score
+
+    train, test = erp_set.train_data, erp_set.test_data
+    model = MODELS[model_name]()
+    extractor = FEATURES[features_name]
+
+    # Fit (feature extraction included) measuring its time
+    start = time.perf_counter()
+    model.fit(extract(train["features"], extractor), np.asarray(train["flags"]))
+    fit_time = time.perf_counter() - start
+
+    # Fit again from scratch to measure the peak of allocated memory (tracemalloc slows
+    # down every allocation, so it can't be on while timing)
+    tracemalloc.start()
+    MODELS[model_name]().fit(extract(train["features"], extractor),
+                             np.asarray(train["flags"]))
+    peak_memory = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    # Batch prediction of the whole test set
+    start = time.perf_counter()
+    test_features = extract(test["features"], extractor)
+    predictions = model.predict(test_features)
+    batch_time = time.perf_counter() - start
+
+    # Only 1 in 6 epochs is a target, so the accuracy of predicting no target at all
+    # is already 0.83: the balanced accuracy and the ROC AUC of the scores rank models
+    flags = np.asarray(test["flags"])
+    accuracy = np.mean(predictions == flags)
+    balanced_accuracy = balanced_accuracy_score(flags, predictions)
+    auc = roc_auc_score(flags, model.decision_function(test_features))
+
+    # One epoch at a time, as it would be online
+    latencies = np.zeros(single_repeats)
+    for i in range(single_repeats):
+        epoch = test["features"][i % len(test["features"])][None, :]
+        start = time.perf_counter()
+        model.decision_function(extract(epoch, extractor))
+        latencies[i] = time.perf_counter() - start
+
+    return {"accuracy": float(accuracy), "balanced_accuracy": float(balanced_accuracy),
+            "roc_auc": float(auc), "fit_time": fit_time,
+            "dimensions": int(test_features.shape[1]),
+            "latency_median_ms": float(np.median(latencies) * 1000),
+            "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "throughput": len(test_features) / batch_time,
+            "peak_memory_mb": peak_memory}
+
+
+def git_revision():
+    """
+    OUTPUT:
+        Commit of the repository the benchmark is run from ("-dirty" added if there
+            are uncommitted changes), or None if it can't be known
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if status.strip() else "")
+
+
+## MAIN ##
+if __name__ == "__main__":
+    # Output file and single epoch predictions timed (e.g. python erp_benchmark.py
+    # out=results.json repeats=500)
+    kwargs = dict_bash_kwargs()
+    out = kwargs.get("out", "benchmark_{0}.json".format(
+        datetime.now().strftime("%y%m%d_%H%M%S")))
+    single_repeats = int(kwargs.get("repeats", 200))
+
+    path_list = sorted(glob.glob(os.path.join("Visual ERP BNCI", "*.mat")))
+
+    results = []
+    for file_ in path_list:
+        subject = os.path.splitext(os.path.basename(file_))[0]
+        erp_set = ERP(file_, cache_dir="erp_cache")
+
+        for model_name in MODELS:
+            for features_name in FEATURES:
+                result = benchmark_pipeline(erp_set, model_name, features_name,
+                                            single_repeats)
+                result.update({"subject": subject, "model": model_name,
+                               "features": features_name})
+                results.append(result)
+                print("{subject} {model:<16} {features:<18} acc {accuracy:.4f}, "
+                      "balanced acc {balanced_accuracy:.4f}, AUC {roc_auc:.4f}, "
+                      "fit {fit_time:.3f} s, latency {latency_median_ms:.3f} ms, "
+                      "{throughput:.0f} epochs/s, {peak_memory_mb:.1f} MB".format(**result))
+
+    # Machine readable results, with the code, versions and parameters to compare runs
+    import sklearn
+    models = {}
+    for model_name in MODELS:
+        # scikit-learn models list their parameters, OnlineLDA only has the shrinkage
+        model = MODELS[model_name]()
+        models[model_name] = (model.get_params() if hasattr(model, "get_params") else
+                              {"shrinkage": model.shrinkage})
+    with open(out, "w") as file_object:
+        json.dump({"date": datetime.now().isoformat(), "revision": git_revision(),
+                   "versions": {"python": platform.python_version(), "numpy": np.__version__,
+                                "scipy": scipy.__version__, "sklearn": sklearn.__version__},
+                   "parameters": {"single_repeats": single_repeats,
+                                  "files": path_list, "models": models,
+                                  "features": {name: extractor.params() for name, extractor
+                                               in FEATURES.items()}},
+                   "results": results}, file_object, indent=2, default=str)
+    print("Results saved to {0}".format(out))
@@ -58,8 +58,13 @@ def preprocess_erp(erp_array):
     """
     This function is used to change the format of the ERP data from the
     dataset used to train LDA and networks. It takes the (#channels
-    + rowcol + flag) x # features array and turns it into 3 lists, that
-    contain different lists for different packets of row/column augmentations.
+    + rowcol + flag) x # features array and turns it into 3 arrays, that
+    contain the feature vectors and labels of the row/column augmentations.
+
+    The segments (augmentations and inter stimuli intervals) are found from the
+    points where the rowcol indicator changes, and every pair of flash + ISI is
+    gathered at once into a (epochs x channels x samples) array, whose rows
+    flattened (channels concatenated) are the feature vectors.
 
     INPUT:
         erp_array: An array shape 11 x # data points, being channels 10 the 
@@ -67,76 +72,137 @@ def preprocess_erp(erp_array):
             11 the trigger indicator (whether the augmented rowcol is the one
             the user is focusing on (1) or not (0)).
     OUTPUT:
-        Dictionary, containing three lists of the same length (number of
-            sequences). First one contains lists with the features
+        Dictionary, containing three arrays of the same length (number of
+            augmentations). First one contains the feature vectors, the second
+            one the rowcol indicators and the third one the flags.
     """
+    # Find the segments in which the rowcol indicator stays the same
+    boundaries = np.flatnonzero(np.diff(erp_array[9])) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [erp_array.shape[1]]))
 
-    # Initialize the lists that are going to hold all the arrays and values
-    features = []
-    rowcol = []
-    flags = []
-
-    # Start the iterations
-    first_index = 0
-    for i in range(erp_array.shape[1]):
-        # If there's data in the temp list and it is a different rowcol, store it as a feature vector
-        if i+1 == erp_array.shape[1] or erp_array[9, i] != erp_array[9, i+1]:
-            # Save features of this chunk to list
-            features.append(erp_array[0:9, first_index:i+1])
-            rowcol.append(erp_array[9, i])
-            flags.append(erp_array[10, i])
-
-            # First index for next chunk is next index
-            first_index = i+1
+    # The first segment is outside of the experiment, giving just baseline information
+    #   As such, we drop it
+    starts = starts[1:]
+    ends = ends[1:]
+    lengths = ends - starts
 
     # Here we standarise the features' vectors to have the same
     # normal lengths, because we can find anomalous vectors.
-
-    # The first element is outside of the experiment, giving just baseline information
-    #   As such, we delete it
-    del(features[0])
-    del(rowcol[0])
-    del(flags[0])
-
-    # Define standard lengths
-    std_len_1 = features[0].shape[1]    # Flash
-    std_len_2 = features[1].shape[1]    # Inter Stimuli Interval
-
-    # Check which elements have length equal to the standar length
-    index = 0
-    while not index >= len(features):
-        iter_len = features[index].shape[1]
-        # Reshape the elements after sequences to have the same shapes as ISI arrays
-        if iter_len != std_len_1 and iter_len != std_len_2:
-            if features[index-1].shape[1] == std_len_1:
-                features[index] = features[index][:, :std_len_2]
-            elif features[index-1].shape[1] == std_len_2:
-                features[index] = features[index][:, :std_len_1]
-        index += 1
-
-    # Compacting and making feature vectors for the training and testing
-    # Start iterating over all the items in the lists
-    iter_ = 0
-    while not iter_+1 >= len(features):
-        # The flatten does the channel concatenation
-        features[iter_] = np.append(
-            features[iter_], features[iter_ + 1], axis=1).flatten()
-        del(features[iter_ + 1])
-        del(rowcol[iter_ + 1])
-        del(flags[iter_ + 1])
-        iter_ += 1
-
-    # Transform into an array
-    features = np.asarray(features)
-    rowcol = np.asarray(rowcol)
-    flags = np.asarray(flags)
-
-    # print("Shape: {0}, Len1: {1}, Len2: {2}, Type: {3}, Type2: {4}".format(features.shape, len(features), features[0].shape, type(features), type(features[0])))
+    std_len_1 = lengths[0]    # Flash
+    std_len_2 = lengths[1]    # Inter Stimuli Interval
+
+    # The segments after sequences are cut to the length that would come after the
+    # previous segment. There are just a few of them, so they are checked one by one.
+    anomalous = np.flatnonzero((lengths != std_len_1) & (lengths != std_len_2))
+    for index in anomalous:
+        if lengths[index-1] == std_len_1:
+            lengths[index] = min(lengths[index], std_len_2)
+        elif lengths[index-1] == std_len_2:
+            lengths[index] = min(lengths[index], std_len_1)
+
+    # Compacting: each segment goes with the next one to make a feature vector.
+    # An unpaired segment at the end is left out.
+    num_epochs = len(starts) // 2
+    first_starts, second_starts = starts[0:2*num_epochs:2], starts[1:2*num_epochs:2]
+    first_lens, second_lens = lengths[0:2*num_epochs:2], lengths[1:2*num_epochs:2]
+    if np.any(first_lens != first_lens[0]) or np.any(second_lens != second_lens[0]):
+        raise ValueError("Segments of the ERP array have non standard lengths")
+
+    # Column indices of every epoch, shape (epochs x samples)
+    columns = np.concatenate(
+        (first_starts[:, None] + np.arange(first_lens[0]),
+         second_starts[:, None] + np.arange(second_lens[0])), axis=1)
+
+    # Gather every channel of every epoch in one go into the 3-D array
+    erp_array = np.ascontiguousarray(erp_array)
+    channels = np.arange(9) * erp_array.shape[1]
+    epochs = np.empty((num_epochs, 9, columns.shape[1]), dtype=erp_array.dtype)
+    np.take(erp_array.ravel(), channels[None, :, None] + columns[:, None, :],
+            out=epochs)
+
+    # The flatten does the channel concatenation (rows of epochs are contiguous)
+    features = epochs.reshape(num_epochs, -1)
+    rowcol = erp_array[9, ends[0:2*num_epochs:2] - 1]
+    flags = erp_array[10, ends[0:2*num_epochs:2] - 1]
 
     # Return a dictionary with the feature vectors and labels.
     return {"features": features, "rowcol": rowcol, "flags": flags}
 
 
+def extract_epochs(data, stamps, onsets, start, stop, baseline=None):
+    """
+    This function cuts the epochs around a list of events from continuous data in a
+    single gather, giving an array of (events x channels x samples).
+
+    INPUT:
+        data: Array of shape (samples x channels) with the continuous data
+        stamps: Increasing timestamps of the samples of data
+        onsets: Timestamps of the events (e.g. stimuli onsets)
+        start: First sample of the epoch, relative to the first sample at or after
+            the onset (e.g. -25 for 50 ms before the onset at 500 Hz)
+        stop: Sample after the last one of the epoch, relative to the same sample
+        baseline: None, or a (bstart, bstop) pair of samples relative to the onset
+            sample. The mean of that interval is subtracted from each channel.
+
+    OUTPUT:
+        Array of shape (events x channels x stop - start). The caller has to make
+            sure all the epochs are inside the data (see processing.Epocher).
+    """
+    data = np.ascontiguousarray(data)
+    channels = data.shape[1]
+
+    # Sample of each onset and the samples of each epoch around it
+    index = np.searchsorted(stamps, onsets)
+    samples = index[:, None] + np.arange(start, stop)
+
+    # Gather every epoch at once into the (events x channels x samples) array
+    epochs = np.empty((len(index), channels, stop - start), dtype=data.dtype)
+    np.take(data.ravel(), samples[:, None, :] * channels +
+            np.arange(channels)[None, :, None], out=epochs)
+
+    # Baseline correction with the mean of the given interval
+    if baseline is not None:
+        epochs -= epochs[:, :, baseline[0] - start:baseline[1] - start].mean(
+            axis=2, keepdims=True)
+
+    return epochs
+
+
+def minmax_decimate(data, bins):
+    """
+    This function reduces continuous data to a given number of bins (e.g. the width
+    of a plot in pixels) keeping the minimum and the maximum of every bin, so the
+    peaks are still seen when plotting at screen resolution. The oldest samples are
+    left out when they don't fill a whole bin.
+
+    INPUT:
+        data: Array of shape (samples x channels)
+        bins: Number of bins of the output
+
+    OUTPUT:
+        decimated: Array of shape (2 * bins x channels), with the minimum and the
+            maximum of each bin one after the other. If there are less than two
+            samples per bin, the data is returned as it is
+        index: Sample of data each row of decimated corresponds to (for the x axis)
+    """
+    samples = len(data)
+    per_bin = samples // max(bins, 1)
+    if per_bin < 2:
+        return data, np.arange(samples)
+
+    # Bins of the most recent samples, reduced at once along the samples of each bin
+    first = samples - per_bin * bins
+    blocks = data[first:].reshape(bins, per_bin, -1)
+    decimated = np.empty((bins, 2, blocks.shape[2]), dtype=data.dtype)
+    np.min(blocks, axis=1, out=decimated[:, 0])
+    np.max(blocks, axis=1, out=decimated[:, 1])
+
+    # Both points of a bin are placed at its first and last samples
+    index = first + np.arange(bins)[:, None] * per_bin + np.array([0, per_bin - 1])
+    return decimated.reshape(2 * bins, -1), index.ravel()
+
+
 def save_sequence(file_name, aug_shuffle, prediction_list, final_prediction, confirmation, position):
     """
     This function is intended to help save all the information from the order of the
@@ -2,6 +2,7 @@
 
 # System imports
 import sys
+from datetime import datetime
 
 # General imports
 import numpy as np
@@ -10,16 +11,20 @@ import scipy as sp
 # Networking imports
 from pylsl import StreamInlet, resolve_stream, local_clock
 
-# Stimuli Imports
-import psychopy as pp
-
 # Custom imports
-from classes import LslStream, Stimuli, LslBuffer, EmojiStimulus
+from acquisition import LslStream, LslBuffer, LslAcquisition, SessionRecorder, profiler
+from processing import FilterBank, Epocher, EvidenceAccumulator, OnlineLDA, FeatureExtractor
+from processing import ClassifierWorker
+from stimulus import EmojiStimulus
 from functions import dict_bash_kwargs, save_sequence
 
 
 ## Main ##
 if __name__ == "__main__":
+    # Latency instrumentation (e.g. python main.py profile=1)
+    kwargs = dict_bash_kwargs()
+    profiler.enable(kwargs.get("profile", "0") == "1")
+
     ## CONNECTION TO STREAM ##
     print("-- STREAM CONNECTION --")
     # Connect to the stream and create the stream handle
@@ -33,6 +38,8 @@ if __name__ == "__main__":
     # Get the number of channels from the inlet to use later
     channelsn = data_stream.inlet.channel_count
     print("Number of channels on the stream: {0}".format(channelsn))
+    # The impedances stream doesn't need to have as many channels
+    imp_channelsn = impedances_stream.inlet.channel_count
 
     # Get the nominal sampling rate (rate at which the server sends information)
     srate = data_stream.inlet.info().nominal_srate()
@@ -41,7 +48,7 @@ if __name__ == "__main__":
     ## STIMULUS INITIALISATION ##
     print("-- STIMULUS SETUP -- ")
     # Initialise the stimulus
-    estimulus = EmojiStimulus()
+    estimulus = EmojiStimulus(markers=True, frame_locked=True, frame_cache=True)
     estimulus.experiment_setup(num_trials=2)
 
     # Print the shuffling sequence
@@ -54,9 +61,29 @@ if __name__ == "__main__":
     print("Ammount of samples per sequence: {0}".format(ammount))
 
     ## CREATE THE BUFFER ##
-    # Create a buffer to hold the samples
-    buffer = LslBuffer()
-    imp_buffer = LslBuffer()
+    # Everything received during the session is recorded in one file per stream
+    time_string = datetime.now().strftime("%y%m%d_%H%M%S")
+    recorder = SessionRecorder("voltages_" + time_string, channelsn, srate)
+    imp_recorder = SessionRecorder("impedances_" + time_string, imp_channelsn, srate)
+
+    # Bandpass and notch filters for the EEG channels (the last 5 are not EEG)
+    filterbank = FilterBank(srate, band=(0.5, 30), notch=50,
+                            picks=np.arange(channelsn - 5))
+
+    # Create ring buffers holding the last minute of samples (filtered for the EEG)
+    capacity = int(np.ceil(60 * srate))
+    buffer = LslBuffer(capacity=capacity, channels=channelsn, recorder=recorder,
+                       filterbank=filterbank)
+    imp_buffer = LslBuffer(capacity=capacity, channels=imp_channelsn,
+                           recorder=imp_recorder)
+
+    # Keep draining both streams into the buffers while PsychoPy blocks
+    acquisition = LslAcquisition([(data_stream, buffer),
+                                  (impedances_stream, imp_buffer)])
+    acquisition.start()
+
+    # Epochs around each augmentation, cut as soon as their data arrives
+    epocher = Epocher(buffer, srate, tmin=-0.1, tmax=0.8, baseline=(-0.1, 0))
 
     ## VIRTUAL COGNIONICS EXCEPTION ##
     # For virtual_cognionics notify the stream
@@ -70,56 +97,175 @@ if __name__ == "__main__":
     #     estimulus.window.flip()
     #     pp.clock.wait(5)
 
+    # Classifier learning from the confirmed trials during the session
+    model = OnlineLDA(shrinkage="auto")
+
+    # Feature vectors of the epochs: EEG channels (not the last 5) at a tenth of the rate
+    extractor = FeatureExtractor(channels=np.arange(channelsn - 5), decimation=10)
+
+    # Both run in another process, so the presentation never waits for the model
+    worker = ClassifierWorker(model, extractor)
+    worker.start()
+
+    # Evidence of each emoji along the sequences, to stop as soon as the target is clear
+    accumulator = EvidenceAccumulator(estimulus.num_emojis, threshold=0.9, min_sequences=2)
+
+    # State of the trial being played: end of each sequence played, its epochs, the
+    # sequences sent to the worker, the decisions (done flag and timestamp) taken with
+    # the scores of each one, and the end of the next Inter Sequence Interval
+    trial = {}
+
+    def augmented(s, e):
+        """ Epoch augmentation e of sequence s from its flip timestamp (the label keeps
+        the sequence and the emoji) and go on with the ready epochs """
+        epocher.add_events(estimulus.seq_onsets[e],
+                           s * estimulus.num_emojis + estimulus.aug_shuffle[s, e])
+        step()
+
+    def gather(force=False):
+        """ Gather the ready epochs and send the sequences whose epochs are all there
+        to the worker (every sequence played if force) """
+        # Every event before the newest sample minus tmax is epoched (or lost) by poll
+        stamps = buffer.last(1)[1]
+        newest = stamps[-1] if len(stamps) else -np.inf
+        epochs, _, labels = epocher.poll()
+        sequences, emojis = np.divmod(labels, estimulus.num_emojis)
+        for s in np.unique(sequences):
+            trial["epochs"][s].append((epochs[sequences == s], emojis[sequences == s]))
+
+        # The scores are late if they are not ready when the next Inter Sequence
+        # Interval ends, as the decision has to wait another sequence then
+        for s, seq_end in trial["ends"].items():
+            if (s in trial["submitted"] or not trial["epochs"][s] or
+                    not (force or newest >= seq_end + epocher.tmax)):
+                continue
+            seq_epochs = np.concatenate([epoch[0] for epoch in trial["epochs"][s]])
+            seq_emojis = np.concatenate([epoch[1] for epoch in trial["epochs"][s]])
+            print("The shape of the epochs array {0}: {1}".format(
+                s + 1, np.shape(seq_epochs)))
+            worker.submit((t, s), seq_epochs, seq_emojis, deadline=trial["isi_end"])
+            trial["submitted"].append(s)
+
+    def step(force=False):
+        """
+        Gather the epochs (see gather) and accumulate the scores that have arrived, in
+        order. It is called along the sequences and the Inter Sequence Intervals, so
+        the epochs of a sequence are scored while the next one is shown. Returns True
+        if the trial can stop.
+        """
+        gather(force)
+
+        # Accumulate the scores in order, so each decision uses the sequences up to it
+        results = worker.poll()
+        while (len(trial["decisions"]) < len(trial["submitted"]) and
+               (t, trial["submitted"][len(trial["decisions"])]) in results):
+            accumulate(results.pop((t, trial["submitted"][len(trial["decisions"])])))
+        return bool(trial["decisions"]) and trial["decisions"][-1][0]
+
+    def accumulate(result, s=None):
+        """ Add the scores of a sequence (of sequence s if there is no result) to the
+        evidence and decide whether the trial can stop """
+        # No evidence until the model has seen both classes (or if it timed out)
+        if result is None:
+            labels = np.concatenate([epoch[1] for epoch in trial["epochs"][s]])
+            result = {"key": (t, s), "scores": np.zeros(len(labels)), "labels": labels}
+        accumulator.update(result["scores"], result["labels"])
+        done, best = accumulator.decide()
+        prediction_list.append(best + 1)
+        trial["decisions"].append((done, local_clock()))
+
+        # Delay from the end of the last epoch of the sequence to its prediction
+        s = result["key"][1]
+        profiler.record("main.prediction_delay", trial["ends"][s] + epocher.tmax)
+        if done:
+            print("Target clear after {0} sequences".format(len(trial["decisions"])))
+
     ## START THE EXPERIMENT ##
     print("\n -- EXPERIMENT STARTING --")
-    prediction_list = []
     # Tell the stream to start
     for t in range(estimulus.num_trials):
+        estimulus.trial = t + 1
+        profiler.trial = t + 1
+        accumulator.reset()
+        prediction_list = []
+        trial.update(ends={}, epochs={}, submitted=[], decisions=[])
         for s in range(estimulus.num_seq):
-            # Play sequence number s according to aug_shuffle
-            estimulus.play_seq(s)
-
-            # Read the data during the sequence (giving some room for error)
-            buffer.add(data_stream.chunk(max_samples=ammount))
-            imp_buffer.add(impedances_stream.chunk(max_samples=ammount))
+            # Play sequence number s according to aug_shuffle, marking the samples
+            # recorded during the sequence with the trial and sequence numbers
+            seq_start = local_clock()
+            recorder.mark(t+1, s+1, seq_start)
+            imp_recorder.mark(t+1, s+1, seq_start)
 
-            # Save just the last part of the data (the one that has to belong to the trial)
-            data = np.asarray(buffer.take_new(
-                ammount, filename="voltages_t{0}_s{1}_".format(t+1, s+1)))
-            imp_buffer.take_new(
-                ammount, filename="impedances_t{0}_s{1}_".format(t+1, s+1))
-            print("The shape of the data array {0}: {1}".format(
-                s + 1, np.shape(data)))
+            # Each augmentation is epoched from the moment it was on screen, and the
+            # epochs of the previous sequence are scored meanwhile
+            trial["isi_end"] = seq_start + estimulus.sequence_duration + estimulus.iseqi
+            trial["epochs"][s] = []
+            estimulus.play_seq(s, callback=augmented)
+            seq_end = local_clock()
+            recorder.mark(t+1, 0, seq_end)
+            imp_recorder.mark(t+1, 0, seq_end)
+            trial["ends"][s] = seq_end
 
-            # Here we would have the part where the sequence is processed to find the choice
-            # PUT MODEL HERE FOR DATA PROCESSING HAVING data AND estimulus.aug_shuffle INTO ACCOUNT
-            prediction_list.append(4)
+            # The post-stimulus window of the last augmentations is longer than the
+            # Inter Sequence Interval, so the sequence is decided one sequence late:
+            # the interval only collects what is ready, and is cut short if the
+            # trial can stop
+            if step():
+                break
+            trial["isi_end"] = local_clock() + estimulus.iseqi
+            estimulus.inter_sequence(callback=step)
+            if step():
+                break
 
-            # Wait the Inter Sequence Interval time
-            pp.clock.wait(estimulus.iseqi)
+        # Without an early stop, the last sequences still have to be scored (there is no
+        # Inter Sequence Interval left to do it, so they have no deadline)
+        trial["isi_end"] = None
+        if not step():
+            last_end = trial["ends"][max(trial["ends"])]
+            with profiler.span("main.wait_samples"):
+                buffer.wait_until(last_end + epocher.tmax, timeout=2)
+            step(force=True)
+            for s in trial["submitted"][len(trial["decisions"]):]:
+                accumulate(worker.result((t, s), timeout=2), s)
+        decision_stamp = trial["decisions"][-1][1]
 
-        # Here we would cramp al the single choices into a final one
-        final_prediction = prediction_list[0]
-
-        # Shuffle again the augmentations
-        estimulus.shuffle()
+        # The final choice is the emoji with the most evidence (positions start at 1)
+        final_prediction = prediction_list[-1]
 
         # Confirm the choice
         print("\n -- GROUND TRUTH --")
         confirmation = estimulus.confirm(final_prediction, transform=False)
+        profiler.record("main.feedback_delay", decision_stamp, estimulus.feedback_stamp)
+
+        # The sequences played after the decision are only epoched now (their data is
+        # there after the confirmation), their scores are not needed anymore
+        buffer.wait_until(trial["ends"][max(trial["ends"])] + epocher.tmax, timeout=2)
+        decided = len(trial["decisions"])
+        gather(force=True)
+        for s in trial["submitted"][decided:]:
+            worker.result((t, s), timeout=0)
 
-        # Save the array
+        # The confirmed target labels the epochs of the trial, which update the model
+        target = int(confirmation[1]) - 1
+        worker.learn([(t, s) for s in trial["submitted"]], target)
+
+        # Save the array (just the sequences played)
         save_file_name = "t{0}_test.txt".format(t+1)
-        save_sequence(save_file_name, estimulus.aug_shuffle, prediction_list,
-                      final_prediction, confirmation[0], confirmation[1])
+        save_sequence(save_file_name, estimulus.aug_shuffle[:len(prediction_list)],
+                      prediction_list, final_prediction, confirmation[0], confirmation[1])
 
-        # Zip the EEG data files
-        buffer.zip()
-        imp_buffer.zip()
+        # Shuffle again the augmentations
+        estimulus.shuffle()
 
-        # Clear buffers
-        buffer.clear(names=True)
-        imp_buffer.clear(names=True)
+        if profiler.enabled:
+            profiler.report(t + 1)
 
     # Close everything
+    worker.report()
+    worker.stop()
+    acquisition.stop()
+    recorder.close()
+    imp_recorder.close()
+    if profiler.enabled:
+        profiler.export("latencies_" + time_string)
     estimulus.quit()
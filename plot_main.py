@@ -9,87 +9,60 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 
 # Networking imports
-from pylsl import StreamInlet, resolve_stream, local_clock
+from pylsl import StreamInlet, resolve_stream
 
 # Custom imports
-import debug_funcs as dfun
-from classes import LslStream, Stimuli, LslBuffer
+from acquisition import LslStream, LslBuffer, LslAcquisition
+from processing import FilterBank
+from functions import dict_bash_kwargs, minmax_decimate
 
 
-def pull_process(stream, func, chunk_size, **kwargs):
+def pull_process(stream, processor, **kwargs):
     """ 
     This function is meant to be the function used to iterate over when pulling 
     and processing is needed.
 
-    The way the function works is collecting the data in the stream and checking
-    if there is enough data to process it (amount needed defined by chunk_size).
-    If there is not, data is buffered to use when there is. When there is enough
-    (either instantly got or buffered) data will be used.
+    The way the function works is pulling the data available in the stream and
+    pushing it to a WindowProcessor, which keeps the samples until there are enough
+    to fill a window (of the length given to the processor) and then calls its
+    processing function once per window with all the channels. The processor
+    discards the samples once they are consumed.
 
     INPUT:
-        inlet: The data stream inlet handle
-        fun: The function used for processing. It should have a format of function(time, data)
-        chunk_size: The amount of data points used for the processing
-        kwargs: Keyword arguments to put into the inlet.pull_chunk method
+        stream: The LslStream to pull from
+        processor: The WindowProcessor (from processing) holding the processing function,
+            which should have a format of function(time, data)
+        kwargs: Keyword arguments to put into the stream.chunk_array method
 
     OUTPUT:
         timestamps: A numpy array containing the timestamps for the collected data.
         data: Collected data in this iteration.
-        processed_data OR []: Note that sometimes due to having low amounts of data to process
-            the function might return an empty list. Additional exceptions must be made in 
-            the programs this is implemented to not overwrite actual data with useless lists.
-            It is implemented this way to keep having the same number of outputs.
+        processed_data OR []: List with the output of the processing function for each
+            window completed in this iteration. Note that it might be empty if there
+            was not enough data to complete a window.
         output_proc: A flag used to signal if there is an output of processed data. This might
             make things easier to avoid issues with using the function.
     """
-    # Retrieve data from the data stream
-    chunk, timestamps = stream.chunk(**kwargs)
-
-    # Only does something if data arrives
-    if timestamps:
-         # Initialize simple buffers if they haven't been already
-        global data_buffer
-        global stamp_buffer
-        if not "data_buffer" in globals():
-            data_buffer = LslBuffer()
-            stamp_buffer = LslBuffer()
-
-        # Add data chunk to buffer and compare the size to the required size
-        data_buffer.add(chunk)
-        stamp_buffer.add(timestamps)
-
-        # Create a flag to see whether or not to output processed data
-        output_proc = False
-
-        # Compare size of buffer to that required size for processing.
-        # If large enough or larger, process and continue storing extra data.
-        if len(data_buffer) >= chunk_size:
-            data = np.array(data_buffer)[:chunk_size]
-            time = np.array(stamp_buffer)[:chunk_size]
-
-            # Process data channel by channel
-            processed_data = []
-            for i in range(stream.inlet.channel_count):
-                processed_temp = func(time, data_buffer.items[:, i])
-                processed_data.append(processed_temp)
-
-            # Get rid of already used data
-            # stamp_buffer = stamp_buffer[chunk_size:]
-            # data_buffer = data_buffer[chunk_size:]
-
-            # Order the function to output the processed data
-            output_proc = True
-
-        # Return raw and processed data with timestamps
-        if output_proc:
-            return timestamps, data, processed_data, output_proc
-        else:
-            return timestamps, data, [], output_proc
+    # Retrieve data from the data stream (copied, the arrays are reused in the next pull)
+    data, timestamps = stream.chunk_array(**kwargs)
+    data, timestamps = data.copy(), timestamps.copy()
+
+    # Process every window completed with the new data
+    processed_data = processor.push(data, timestamps)
+    output_proc = len(processed_data) > 0
+
+    # Return raw and processed data with timestamps
+    return timestamps, data, processed_data, output_proc
 
 
 # Main
 # To execute if script is executed as main (direct execution, not as an import)
+# (e.g. python plot_main.py window=5 fps=30 spacing=100)
 if __name__ == "__main__":
+    kwargs = dict_bash_kwargs()
+    plot_duration = float(kwargs.get("window", 5))  # Seconds shown
+    fps = float(kwargs.get("fps", 30))  # Redraws per second
+    spacing = float(kwargs.get("spacing", 1))  # Vertical distance between channels
 
     # Connect via LSL to data stream
     data_stream = LslStream(type="EEG")
@@ -97,46 +70,60 @@ if __name__ == "__main__":
     # Get the number of channels from the inlet to use later
     channelsn = data_stream.inlet.channel_count
     print("Number of channels on the stream: {0}".format(channelsn))
+    srate = data_stream.inlet.info().nominal_srate()
+
+    # Filter the EEG channels (all but the last 5) before displaying them
+    display_filter = FilterBank(srate, band=(0.5, 30), notch=50,
+                                picks=np.arange(channelsn - 5))
 
-    # Create the PyQtGraph window
-    plot_duration = 1
+    # Ring buffer with the samples of the window shown, filled by the acquisition
+    # thread at its own pace (the redraws only read the last samples)
+    buffer = LslBuffer(capacity=int(np.ceil(plot_duration * srate)), channels=channelsn,
+                       filterbank=display_filter)
+    acquisition = LslAcquisition([(data_stream, buffer)], interval=0.01)
+    acquisition.start()
+
+    # Create the PyQtGraph window, with a single curve holding all the channels
     win = pg.GraphicsWindow()
     win.setWindowTitle("LSL Plot " + data_stream.inlet.info().name())
     plt = win.addPlot()
-    plt.setLimits(xMin=0.0, xMax=plot_duration, yMin=-1.0 *
-                  (data_stream.inlet.channel_count - 1), yMax=1.0)
+    plt.setLimits(xMin=-plot_duration, xMax=0.0,
+                  yMin=-spacing * channelsn, yMax=spacing)
+    curve = pg.PlotCurveItem()
+    plt.addItem(curve)
+
+    # Vertical position of each channel
+    offsets = -spacing * np.arange(channelsn, dtype=np.float32)
 
-    t0 = [local_clock()] * data_stream.inlet.channel_count
-    curves = []
-    for ch_ix in range(data_stream.inlet.channel_count):
-        curves += [plt.plot()]
-    inlet = data_stream.inlet
+    # Arrays of the frame, allocated again only when the number of points changes
+    frame = {"points": 0}
 
     def update():
-        # Be able to modify this global variables
-        global curves, t0
-        chunk, timestamps = data_stream.chunk(timeout=0.0)
-        print("LONG:" + str(len(timestamps)))
-        if timestamps:
-            # print(chunk)
-            timestamps = np.asarray(timestamps)
-            y = np.asarray(chunk)
-
-            for ch_ix in range(data_stream.inlet.channel_count):
-                old_x, old_y = curves[ch_ix].getData()
-                if old_x is not None:
-                    old_x += t0[ch_ix]
-                    this_x = np.hstack((old_x, timestamps))
-                    this_y = np.hstack((old_y, y[:, ch_ix] - ch_ix))
-                else:
-                    this_x = timestamps
-                    this_y = y[:, ch_ix] - ch_ix
-                t0[ch_ix] = this_x[-1] - plot_duration
-                this_x -= t0[ch_ix]
-                b_keep = this_x >= 0
-                curves[ch_ix].setData(this_x[b_keep], this_y[b_keep])
+        # Min/max of each pixel column of the plot, of the samples in the window
+        bins = max(int(plt.getViewBox().width()), 100)
+        with buffer.lock:
+            data, _ = buffer.last(len(buffer))
+            decimated, index = minmax_decimate(data, bins)
+            points = len(index)
+            if points == 0:
+                return
+            if points != frame["points"]:
+                frame["points"] = points
+                frame["y"] = np.empty((channelsn, points), dtype=np.float32)
+                frame["x"] = np.empty((channelsn, points))
+                # Every channel is a separate line: no segment from its end to the next
+                frame["connect"] = np.ones(channelsn * points, dtype=bool)
+                frame["connect"][points - 1::points] = False
+
+            # Offset-stacked channels (one row each), copied while the buffer is locked
+            np.add(decimated.T, offsets[:, None], out=frame["y"])
+            frame["x"][:] = (index - len(data)) / srate
+
+        curve.setData(frame["x"].ravel(), frame["y"].ravel(), connect=frame["connect"])
 
     timer = QtCore.QTimer()
     timer.timeout.connect(update)
-    timer.start(5)  # Let some time for the source to create data
+    timer.start(int(1000 / fps))
     QtGui.QApplication.instance().exec_()
+
+    acquisition.stop()
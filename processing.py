@@ -0,0 +1,730 @@
+# General imports
+import numpy as np
+import time
+import queue
+import multiprocessing
+from scipy import signal, ndimage
+
+# Networking imports
+from pylsl import local_clock
+
+# Custom imports
+from functions import extract_epochs
+from acquisition import profiler
+
+
+class FilterBank(object):
+    """
+    Online multichannel IIR filtering (a bandpass and a notch) for streams. Both filters
+    are designed as second-order sections and stacked in a single cascade, which filters
+    all the channels of a chunk in one call of scipy.signal.sosfilt. The state of the
+    filters (zi) is carried from one chunk to the next one, so filtering chunk by chunk
+    gives the same output as filtering the whole signal at once (no discontinuities).
+
+    METHODS:
+        __init__(srate, band, notch, order, quality, picks): Design the filters
+        process(data): Filter a (samples x channels) chunk
+        reset: Forget the state, the next chunk starts the filters again
+
+    ATTRIBUTES:
+        self.sos: Second-order sections of the whole cascade
+        self.picks: Indices of the channels filtered (all of them if None), so
+            channels like counters or triggers can be left untouched
+    """
+
+    def __init__(self, srate, band=(0.5, 30), notch=50, order=4, quality=30, picks=None):
+        sections = []
+        if band is not None:
+            sections.append(signal.butter(order, band, btype="bandpass", fs=srate,
+                                          output="sos"))
+        if notch is not None:
+            b, a = signal.iirnotch(notch, quality, fs=srate)
+            sections.append(signal.tf2sos(b, a))
+        if not sections:
+            raise ValueError("FilterBank needs a band, a notch or both")
+
+        self.sos = np.concatenate(sections)
+        self.picks = picks
+        self._zi = None
+
+    def process(self, data):
+        """ Filter a chunk of shape (samples x channels), returning a new array """
+        data = np.asarray(data)
+        if len(data) == 0:
+            return data
+        picked = data if self.picks is None else data[:, self.picks]
+
+        # Start from the steady state of the first sample so there is no step at the start
+        if self._zi is None:
+            self._zi = signal.sosfilt_zi(self.sos)[:, :, None] * picked[0]
+
+        filtered, self._zi = signal.sosfilt(self.sos, picked, axis=0, zi=self._zi)
+
+        if self.picks is None:
+            return filtered
+        output = np.array(data, dtype=filtered.dtype)
+        output[:, self.picks] = filtered
+        return output
+
+    def reset(self):
+        self._zi = None
+
+
+class FeatureExtractor(object):
+    """
+    Feature extraction from epochs, working on the whole (epochs x channels x samples)
+    array at once. In order, it selects channels, decimates (with an anti-aliasing FIR
+    lowpass, short enough for epochs of a few samples) and averages consecutive windows
+    of samples, and then concatenates the channels into the feature vectors. The same
+    object is used offline (ERPDataset) and online (main.py), so both get the same
+    features.
+
+    METHODS:
+        __init__(channels, decimation, window): Set up the stages
+        transform(epochs): Feature vectors of the epochs
+        params: Parameters of the stages (used in cache keys)
+
+    ATTRIBUTES:
+        self.channels: Indices of the channels kept (all of them if None)
+        self.decimation: Decimation factor (1 to keep the rate)
+        self.window: Samples averaged together after the decimation (1 for none)
+    """
+
+    def __init__(self, channels=None, decimation=1, window=1):
+        self.channels = None if channels is None else list(channels)
+        self.decimation = decimation
+        self.window = window
+
+        # Lowpass at the new Nyquist frequency
+        if decimation > 1:
+            self._lowpass = signal.firwin(4 * decimation + 1, 1 / decimation)
+
+    def params(self):
+        return {"channels": self.channels, "decimation": self.decimation,
+                "window": self.window}
+
+    def transform(self, epochs):
+        """
+        INPUT:
+            epochs: Array of shape (epochs x channels x samples)
+
+        OUTPUT:
+            Array of shape (epochs x features)
+        """
+        epochs = np.asarray(epochs)
+        if self.channels is not None:
+            epochs = epochs[:, self.channels]
+
+        if self.decimation > 1:
+            epochs = ndimage.convolve1d(epochs, self._lowpass, axis=2, mode="nearest")
+            epochs = epochs[:, :, ::self.decimation]
+
+        # Mean of each window (the samples left at the end are dropped)
+        if self.window > 1:
+            windows = epochs.shape[2] // self.window
+            epochs = epochs[:, :, :windows * self.window].reshape(
+                epochs.shape[0], epochs.shape[1], windows, self.window).mean(axis=3)
+
+        return epochs.reshape(len(epochs), -1)
+
+
+class SpectralEstimator(object):
+    """
+    Streaming Welch power spectral density estimator for all the channels of a stream.
+    The chunks are split into overlapping segments as they arrive and every new segment
+    of every channel goes through a single batched rfft (with the window and the
+    frequency bins computed once). The PSD is the mean of the last periodograms, so it
+    is updated incrementally without going over the history again.
+
+    METHODS:
+        __init__(srate, nperseg, overlap, averages, window): Set up the estimator
+        update(data): Add a (samples x channels) chunk
+        psd: Current PSD estimate, shape (channels x frequencies)
+        band_power(low, high): Power of each channel in a frequency band
+        line_noise_ratio(line, width, band): Signal quality as line noise / EEG power
+
+    ATTRIBUTES:
+        self.freqs: Frequencies of the PSD bins (Hz)
+        self.nperseg: Samples per segment
+        self.hop: Samples between the starts of consecutive segments
+        self.averages: Number of periodograms averaged
+        self.segments: Number of segments in the current estimate
+    """
+
+    def __init__(self, srate, nperseg=256, overlap=0.5, averages=8, window="hann"):
+        self.srate = srate
+        self.nperseg = nperseg
+        self.hop = max(1, nperseg - int(nperseg * overlap))
+        self.averages = averages
+        self.freqs = np.fft.rfftfreq(nperseg, 1 / srate)
+        self.window = signal.get_window(window, nperseg)
+
+        # Density scaling as in Welch's method (one-sided, so the inner bins count twice)
+        self._scale = np.full(len(self.freqs), 2 / (srate * np.sum(self.window ** 2)))
+        self._scale[0] /= 2
+        if nperseg % 2 == 0:
+            self._scale[-1] /= 2
+
+        self._pending = None        # Samples not used by a segment yet
+        self._periodograms = None   # Ring with the last periodograms
+        self._next = 0
+        self.segments = 0
+
+    def update(self, data):
+        """ Add a chunk (samples x channels) and compute the periodograms of the new
+        complete segments """
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim == 1:
+            data = data[:, None]
+        if self._pending is None:
+            self._pending = np.zeros((0, data.shape[1]))
+            self._periodograms = np.zeros((self.averages, data.shape[1], len(self.freqs)))
+        pending = np.concatenate((self._pending, data))
+
+        num_segments = 0 if len(pending) < self.nperseg else \
+            (len(pending) - self.nperseg) // self.hop + 1
+        if num_segments == 0:
+            self._pending = pending
+            return
+
+        # (segments x channels x nperseg) views of the pending samples
+        segments = np.lib.stride_tricks.sliding_window_view(
+            pending, self.nperseg, axis=0)[::self.hop][:num_segments]
+        segments = segments - segments.mean(axis=2, keepdims=True)
+
+        # One rfft for every segment and channel
+        periodograms = np.abs(np.fft.rfft(segments * self.window, axis=2)) ** 2 * self._scale
+
+        # Only the last ones are averaged
+        periodograms = periodograms[-self.averages:]
+        index = (self._next + np.arange(len(periodograms))) % self.averages
+        self._periodograms[index] = periodograms
+        self._next = (self._next + len(periodograms)) % self.averages
+        self.segments = min(self.segments + len(periodograms), self.averages)
+
+        self._pending = pending[num_segments * self.hop:]
+
+    @property
+    def psd(self):
+        """ Mean of the last periodograms (channels x frequencies), in units^2/Hz """
+        if self.segments == 0:
+            return None
+        if self.segments < self.averages:
+            return self._periodograms[:self.segments].mean(axis=0)
+        return self._periodograms.mean(axis=0)
+
+    def band_power(self, low, high):
+        """ Power of each channel between low and high Hz (units^2), None until there
+        is a complete segment (as psd) """
+        psd = self.psd
+        if psd is None:
+            return None
+        band = (self.freqs >= low) & (self.freqs <= high)
+        return psd[:, band].sum(axis=1) * (self.freqs[1] - self.freqs[0])
+
+    def line_noise_ratio(self, line=50, width=2, band=(1, 40)):
+        """ Ratio of the power around the line frequency to the power in the EEG band,
+        for each channel (None without a PSD yet). High values point at bad contacts. """
+        if self.psd is None:
+            return None
+        return self.band_power(line - width, line + width) / self.band_power(*band)
+
+
+class WindowProcessor(object):
+    """
+    Sliding window processing of a stream. Chunks of any size are pushed into the
+    processor, which owns its buffer, and the processing function is called once for
+    every complete window on the whole (samples x channels) array, so the function
+    can work on all the channels at once. Consumed samples are discarded, so only
+    the samples of the window being filled are kept.
+
+    METHODS:
+        __init__(func, window, hop, dtype): Set up the processor
+        push(data, stamps): Add a chunk and process the windows it completes
+        clear: Forget the samples held
+
+    ATTRIBUTES:
+        self.func: Processing function, with the format func(time, data) where time
+            are the stamps of the window and data has shape (window x channels). Both
+            are views of the internal buffer, so func should not keep them.
+        self.window: Length of the windows (samples)
+        self.hop: Samples between the start of consecutive windows (the window
+            length by default, i.e. no overlap)
+    """
+
+    def __init__(self, func, window, hop=None, dtype="float32"):
+        self.func = func
+        self.window = window
+        self.hop = window if hop is None else hop
+        self.dtype = np.dtype(dtype)
+
+        self._data = None
+        self._stamps = None
+        self._count = 0     # Samples held
+        self._skip = 0      # Samples still to skip when the hop is longer than the window
+
+    def __len__(self):
+        return self._count
+
+    def push(self, data, stamps):
+        """
+        Add a chunk of samples and process every window that is complete.
+
+        INPUT:
+            data: Chunk of shape (samples x channels)
+            stamps: Timestamps of the chunk
+
+        OUTPUT:
+            List with the outputs of func for the windows completed (can be empty)
+        """
+        stamps = np.asarray(stamps, dtype=np.float64)
+        if len(stamps) == 0:
+            # Pulls without timeout often give nothing (and can't be reshaped)
+            return []
+        data = np.asarray(data, dtype=self.dtype).reshape(len(stamps), -1)
+
+        # Samples in the gap between windows are not even stored
+        skip = min(self._skip, len(stamps))
+        data, stamps = data[skip:], stamps[skip:]
+        self._skip -= skip
+
+        # Grow the buffer if the chunk does not fit (it only ever holds a window and a chunk)
+        needed = self._count + len(stamps)
+        if self._data is None or needed > len(self._stamps):
+            capacity = max(needed, 2 * self.window)
+            new_data = np.zeros((capacity, data.shape[1]), dtype=self.dtype)
+            new_stamps = np.zeros(capacity)
+            if self._data is not None:
+                new_data[:self._count] = self._data[:self._count]
+                new_stamps[:self._count] = self._stamps[:self._count]
+            self._data, self._stamps = new_data, new_stamps
+
+        self._data[self._count:needed] = data
+        self._stamps[self._count:needed] = stamps
+        self._count = needed
+
+        # Process every complete window
+        outputs = []
+        start = 0
+        while start + self.window <= self._count:
+            outputs.append(self.func(self._stamps[start:start + self.window],
+                                     self._data[start:start + self.window]))
+            start += self.hop
+
+        # Discard the consumed samples, moving the rest to the start of the buffer
+        consumed = min(start, self._count)
+        self._skip = start - consumed
+        remaining = self._count - consumed
+        if consumed:
+            self._data[:remaining] = self._data[consumed:self._count]
+            self._stamps[:remaining] = self._stamps[consumed:self._count]
+            self._count = remaining
+
+        return outputs
+
+    def clear(self):
+        self._count = 0
+        self._skip = 0
+
+
+class Epocher(object):
+    """
+    Online epoching of a continuous ring buffer (LslBuffer with a capacity) around
+    stimuli onsets. Events are added with their onset timestamps and each call to
+    poll gives the epochs of the events whose post-stimulus window has arrived to the
+    buffer, so they can be classified while the sequence is still running. All the
+    ready epochs are cut at once with functions.extract_epochs.
+
+    METHODS:
+        __init__(buffer, srate, tmin, tmax, baseline): Set up the epoching windows
+        add_events(onsets, labels): Add events waiting to be epoched
+        poll: Get the epochs of the events that are complete
+
+    ATTRIBUTES:
+        self.buffer: The LslBuffer the epochs are cut from
+        self.tmin, self.tmax: Window of the epochs around the onsets (s)
+        self.start, self.stop: Same window in samples
+        self.baseline: Baseline interval in samples relative to the onset (or None)
+        self.pending: Number of events waiting for their data
+    """
+
+    def __init__(self, buffer, srate, tmin=-0.1, tmax=0.8, baseline=(-0.1, 0)):
+        self.buffer = buffer
+        self.tmin = tmin
+        self.tmax = tmax
+        self.start = int(round(tmin * srate))
+        self.stop = int(round(tmax * srate))
+        if baseline is None:
+            self.baseline = None
+        else:
+            self.baseline = (int(round(baseline[0] * srate)),
+                             int(round(baseline[1] * srate)))
+
+        self._onsets = np.zeros(0)
+        self._labels = np.zeros(0, dtype=int)
+
+    @property
+    def pending(self):
+        return len(self._onsets)
+
+    def add_events(self, onsets, labels):
+        """ Add events (onset timestamps and a label for each one, e.g. the emoji) """
+        self._onsets = np.append(self._onsets, onsets)
+        self._labels = np.append(self._labels, labels)
+
+    def poll(self):
+        """
+        Cut the epochs of the events whose whole window is in the buffer. Events whose
+        pre-stimulus samples are no longer in the buffer are dropped.
+
+        OUTPUT:
+            epochs: Array (events x channels x samples) of the complete events
+            onsets: Onsets of those events
+            labels: Labels of those events
+        """
+        with profiler.span("epocher.poll"), self.buffer.lock:
+            data, stamps = self.buffer.last(len(self.buffer))
+            index = np.searchsorted(stamps, self._onsets)
+            ready = index + self.stop <= len(stamps)
+            # The onset has arrived but not the samples before it, they never will
+            lost = (index + self.start < 0) & (index < len(stamps))
+
+            epochs = extract_epochs(data, stamps, self._onsets[ready & ~lost],
+                                    self.start, self.stop, self.baseline)
+
+        onsets, labels = self._onsets[ready & ~lost], self._labels[ready & ~lost]
+
+        # Delay from the end of each epoch window until the epoch is built
+        if profiler.enabled:
+            for onset in onsets:
+                profiler.record("epoch.delay", onset + self.tmax)
+            profiler.count("epochs.lost", int(np.sum(lost)))
+        if np.any(lost):
+            print("Epocher: {0} events lost, their data is not in the buffer anymore".format(
+                np.sum(lost)))
+
+        # Keep waiting for the rest of events
+        waiting = ~(ready | lost)
+        self._onsets, self._labels = self._onsets[waiting], self._labels[waiting]
+        return epochs, onsets, labels
+
+
+class EvidenceAccumulator(object):
+    """
+    Online decision of the target emoji from the classifier scores of the epochs. The
+    scores of every sequence are added to the emoji augmented in each epoch, and the
+    accumulated evidence is turned into a probability for each emoji (a softmax, so
+    scores behaving like log-likelihood ratios give the posterior). Once one emoji is
+    clear enough the trial can stop without playing the rest of sequences.
+
+    METHODS:
+        __init__(num_emojis, threshold, min_sequences, temperature): Set up the decision
+        reset: Forget the evidence (at the start of each trial)
+        update(scores, emojis): Add the scores of the epochs of a sequence
+        probabilities: Probability of each emoji being the target
+        decide: Whether the trial can stop and which emoji is the best one
+
+    ATTRIBUTES:
+        self.threshold: Probability the best emoji needs to stop the trial
+        self.min_sequences: Sequences always played before stopping
+        self.temperature: Scale of the scores in the softmax
+        self.evidence: Accumulated score of each emoji
+        self.counts: Number of epochs of each emoji
+        self.sequences: Number of sequences accumulated
+    """
+
+    def __init__(self, num_emojis, threshold=0.9, min_sequences=2, temperature=1.0):
+        self.num_emojis = num_emojis
+        self.threshold = threshold
+        self.min_sequences = min_sequences
+        self.temperature = temperature
+        self.reset()
+
+    def reset(self):
+        self.evidence = np.zeros(self.num_emojis)
+        self.counts = np.zeros(self.num_emojis, dtype=int)
+        self.sequences = 0
+
+    def update(self, scores, emojis):
+        """
+        Add the scores of the epochs of one sequence.
+
+        INPUT:
+            scores: Classifier score of each epoch (higher means more target-like)
+            emojis: Emoji augmented in each epoch (position in the screen, from 0),
+                as given by the Epocher labels or aug_shuffle
+        """
+        np.add.at(self.evidence, np.asarray(emojis, dtype=int), scores)
+        np.add.at(self.counts, np.asarray(emojis, dtype=int), 1)
+        self.sequences += 1
+
+    @property
+    def probabilities(self):
+        scaled = self.evidence / self.temperature
+        exp = np.exp(scaled - scaled.max())
+        return exp / exp.sum()
+
+    def decide(self):
+        """
+        OUTPUT:
+            done: True if the best emoji is clear enough to stop the trial
+            best: Position (from 0) of the emoji with the most evidence
+        """
+        probabilities = self.probabilities
+        best = int(np.argmax(probabilities))
+        done = (self.sequences >= self.min_sequences and
+                probabilities[best] >= self.threshold)
+        return done, best
+
+
+class OnlineLDA(object):
+    """
+    Binary shrinkage Linear Discriminant Analysis that learns online. Instead of keeping
+    the training data, it keeps the number of epochs, the mean and the scatter matrix of
+    each class, which are merged with every new batch of labelled epochs using rank-k
+    updates. The cost of an update depends on the size of the batch and the features,
+    never on the amount of epochs seen before, so the model can adapt after every
+    confirmed trial.
+
+    The shrinkage of the pooled covariance towards a scaled identity can be fixed (a
+    float in [0, 1]) or, with "auto", estimated with the Oracle Approximating Shrinkage
+    formula, which only needs the covariance and the number of epochs.
+
+    METHODS:
+        __init__(shrinkage): Create an empty model
+        reset: Forget everything learnt
+        partial_fit(X, y): Update the model with labelled epochs
+        fit(X, y): Reset and learn from scratch
+        decision_function(X): Score of the epochs (positive means target)
+        predict(X): Predicted labels (0 non-target, 1 target)
+
+    ATTRIBUTES:
+        self.shrinkage: Shrinkage parameter, or "auto"
+        self.counts: Number of epochs of each class
+        self.means: Mean feature vector of each class
+        self.coef_, self.intercept_: Weights and bias of the discriminant
+        self.ready: True when both classes have been seen
+    """
+
+    def __init__(self, shrinkage="auto"):
+        self.shrinkage = shrinkage
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(2, dtype=int)
+        self.means = None
+        self._scatter = None
+        self._coef = None
+
+    @property
+    def ready(self):
+        return bool(np.all(self.counts > 1))
+
+    def partial_fit(self, X, y):
+        """
+        Merge a batch of epochs into the model.
+
+        INPUT:
+            X: Features of shape (epochs x features)
+            y: Label of each epoch (1 for target, 0 for non-target)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y).astype(bool)
+        if self.means is None:
+            self.means = np.zeros((2, X.shape[1]))
+            self._scatter = np.zeros((X.shape[1], X.shape[1]))
+
+        for label in (0, 1):
+            batch = X[y == bool(label)]
+            if len(batch) == 0:
+                continue
+
+            # Chan et al. merge of the batch statistics into the class statistics
+            n_old, n_new = self.counts[label], len(batch)
+            batch_mean = batch.mean(axis=0)
+            centered = batch - batch_mean
+            delta = batch_mean - self.means[label]
+            total = n_old + n_new
+
+            self._scatter += centered.T @ centered
+            self._scatter += np.outer(delta, delta) * (n_old * n_new / total)
+            self.means[label] += delta * (n_new / total)
+            self.counts[label] = total
+
+        # The discriminant is solved again the next time it is needed
+        self._coef = None
+        return self
+
+    def fit(self, X, y):
+        self.reset()
+        return self.partial_fit(X, y)
+
+    def _solve(self):
+        """ Solve the discriminant with the shrunk pooled covariance """
+        features = self._scatter.shape[0]
+        n = self.counts.sum()
+        covariance = self._scatter / (n - 2)
+        mu = np.trace(covariance) / features
+
+        if self.shrinkage == "auto":
+            # Oracle Approximating Shrinkage (Chen et al., 2010)
+            trace_2 = np.sum(covariance ** 2)
+            trace_sq = np.trace(covariance) ** 2
+            numerator = (1 - 2 / features) * trace_2 + trace_sq
+            denominator = (n + 1 - 2 / features) * (trace_2 - trace_sq / features)
+            shrinkage = 1.0 if denominator == 0 else min(1.0, numerator / denominator)
+        else:
+            shrinkage = self.shrinkage
+
+        covariance *= (1 - shrinkage)
+        covariance[np.diag_indices(features)] += shrinkage * mu
+
+        self._coef = np.linalg.solve(covariance, self.means[1] - self.means[0])
+        self._intercept = (-self._coef @ (self.means[0] + self.means[1]) / 2 +
+                           np.log(self.counts[1] / self.counts[0]))
+
+    @property
+    def coef_(self):
+        if self._coef is None:
+            self._solve()
+        return self._coef
+
+    @property
+    def intercept_(self):
+        if self._coef is None:
+            self._solve()
+        return self._intercept
+
+    def decision_function(self, X):
+        return np.asarray(X) @ self.coef_ + self.intercept_
+
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(int)
+
+
+class ClassifierWorker(multiprocessing.Process):
+    """
+    Process doing the feature extraction and classification of the epochs, so the
+    stimulus loop only has to submit the epochs of a sequence and collect the scores
+    when it needs them, waiting at most a timeout, and a slow model never stalls the
+    presentation. The worker keeps the features of the sequences it scored, so the
+    model can learn from them once the target of the trial is known.
+
+    Every submission can have a deadline (a LSL timestamp, e.g. the end of the Inter
+    Sequence Interval). Results computed after their deadline are reported when they
+    are collected and kept in self.misses. A result that result() stopped waiting for
+    is dropped when it arrives, so the late ones don't pile up in self.results.
+
+    METHODS:
+        __init__(model, extractor): Set up the worker with the model (with
+            decision_function and partial_fit, e.g. OnlineLDA) and a FeatureExtractor
+        submit(key, epochs, labels, deadline): Queue the epochs of a sequence to score
+        learn(keys, target): Update the model with the sequences of keys, the epochs
+            whose label is target being the positive ones
+        result(key, timeout): Wait for the result of a submission (None on timeout)
+        poll: Collect the results that are already finished
+        report: Print a summary of the results that missed their deadline
+        stop: Finish the queued work and stop the process
+
+    ATTRIBUTES:
+        self.results: Finished results not yet asked for, by key. Each result is a
+            dictionary with the key, scores, labels and the submitted, started,
+            finished and deadline timestamps
+        self.misses: Results that finished after their deadline
+        self.abandoned: Keys whose result timed out (dropped when they arrive)
+    """
+
+    def __init__(self, model, extractor=None):
+        super().__init__(daemon=True)
+        self.model = model
+        self.extractor = extractor
+        self.results = {}
+        self.misses = []
+        self.abandoned = set()
+        self._inbox = multiprocessing.Queue()
+        self._outbox = multiprocessing.Queue()
+
+    def run(self):
+        # Features and labels of the sequences scored, until the model learns them
+        stored = {}
+        while True:
+            message = self._inbox.get()
+            if message is None:
+                break
+
+            if message[0] == "predict":
+                _, key, epochs, labels, deadline, submitted = message
+                started = local_clock()
+                if self.extractor is not None:
+                    features = self.extractor.transform(epochs)
+                else:
+                    features = epochs.reshape(len(epochs), -1)
+                stored[key] = (features, labels)
+
+                # No scores until the model has seen both classes
+                if getattr(self.model, "ready", True):
+                    scores = self.model.decision_function(features)
+                else:
+                    scores = np.zeros(len(features))
+                self._outbox.put({"key": key, "scores": scores, "labels": labels,
+                                  "submitted": submitted, "started": started,
+                                  "finished": local_clock(), "deadline": deadline})
+
+            elif message[0] == "learn":
+                _, keys, target = message
+                sequences = [stored.pop(key) for key in keys if key in stored]
+                if sequences:
+                    self.model.partial_fit(
+                        np.concatenate([features for features, _ in sequences]),
+                        np.concatenate([labels for _, labels in sequences]) == target)
+
+    def submit(self, key, epochs, labels, deadline=None):
+        self._inbox.put(("predict", key, np.asarray(epochs), np.asarray(labels),
+                         deadline, local_clock()))
+
+    def learn(self, keys, target):
+        self._inbox.put(("learn", list(keys), target))
+
+    def _collect(self, result):
+        profiler.record("worker.prediction", result["submitted"], result["finished"])
+        if result["deadline"] is not None and result["finished"] > result["deadline"]:
+            self.misses.append(result)
+            print("ClassifierWorker: result {0} missed its deadline by {1:.1f} ms".format(
+                result["key"], (result["finished"] - result["deadline"]) * 1000))
+        # Nobody is waiting for a result that timed out any more
+        if result["key"] in self.abandoned:
+            self.abandoned.discard(result["key"])
+        else:
+            self.results[result["key"]] = result
+
+    def poll(self):
+        """ Collect the finished results (without waiting) and return them by key """
+        while True:
+            try:
+                self._collect(self._outbox.get_nowait())
+            except queue.Empty:
+                return self.results
+
+    def result(self, key, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while key not in self.results:
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            try:
+                self._collect(self._outbox.get(timeout=remaining))
+            except queue.Empty:
+                self.abandoned.add(key)
+                return None
+        return self.results.pop(key)
+
+    def report(self):
+        late = [(result["finished"] - result["deadline"]) * 1000 for result in self.misses]
+        if late:
+            print("ClassifierWorker: {0} results missed their deadline "
+                  "(median {1:.1f} ms late, max {2:.1f} ms)".format(
+                      len(late), np.median(late), np.max(late)))
+        else:
+            print("ClassifierWorker: every result was on time")
+
+    def stop(self, timeout=None):
+        self._inbox.put(None)
+        self.join(timeout)
@@ -0,0 +1,543 @@
+# General imports
+import numpy as np
+import glob
+import platform
+if platform.architecture()[1][:7] == "Windows":
+    from win32api import GetSystemMetrics
+
+# Networking imports
+from pylsl import local_clock, StreamInfo, StreamOutlet, IRREGULAR_RATE
+
+# Visual imports
+from psychopy import visual, core, clock, event
+
+# Custom imports
+from acquisition import profiler
+
+
+class Stimuli(object):
+    """
+    Class used as a container for the stimuli of the experiment. The advantage
+    of using this object mainly comes in the form of using a single draw() method
+    to update all of them and being able to see which stimuli the experiment has.
+
+    METHODS:
+        __init__(): Create a list for the items and the labels
+        add(stimulus, label): Add an stimulus to the lists with given label
+        draw(): Draw all the stimuli on a opened PsychoPy window
+        draw_int(imin, imax): Draw SOME stimuli (in the slice of imin:imax)
+        see(): Check labels
+        swap(pos1, pos2): Swap to stimuli and their labels
+        cache(window, key, draw_func): Composite a screen into a single image
+        blit(key): Draw a cached screen
+
+    ATTRIBUTES:
+        self.items: Contains the stimuli
+        self.labels: Contains stimuli's labels
+        self.frames: Cached screens (BufferImageStim) by key
+    """
+
+    # When the object initializes, it creates an empty list to contain stimuli
+    def __init__(self):
+        self.items = []
+        self.labels = []
+        self.frames = {}
+
+    # Method to add stimuli
+    def add(self, stimulus, label):
+        if type(stimulus) == type([]):
+            self.items.extend(stimulus)
+            self.labels.extend(label)
+        else:
+            self.items.append(stimulus)
+            self.labels.append(label)
+
+    # Method to update all stimuli "simultaneously"
+    def draw(self):
+        for i in range(len(self.items)):
+            self.items[i].draw()
+
+    # Draw some stimuli in an interval given by imin-imax
+    def draw_int(self, imin, imax):
+        for i in range(len(self.items[imin:imax])):
+            self.items[imin+i].draw()
+
+    # See which stimuli are contained
+    def see(self):
+        print("Labels (in order): {0}".format(self.labels))
+
+    # Swap the place of two stimuli, since the drawing is done from first to last
+    def swap(self, pos1, pos2):
+        self.items[pos1], self.items[pos2] = self.items[pos2], self.items[pos1]
+        self.labels[pos1], self.labels[pos2] = self.labels[pos2], self.labels[pos1]
+
+    # Invert the order of the stimuli
+    def invert(self):
+        self.items = self.items[::-1]
+        self.labels = self.labels[::-1]
+
+    # Put an stimulus first in the list
+    def first(self, position):
+        for i in range(position):
+            self.swap(i, position)
+
+    # Put an stimulus lastin the list
+    def last(self, position):
+        self.invert()
+        self.first(-position)
+        self.invert()
+
+    # Composite whatever draw_func draws (all the stimuli by default) into one image
+    def cache(self, window, key, draw_func=None):
+        window.clearBuffer()
+        if draw_func is None:
+            self.draw()
+        else:
+            draw_func()
+        self.frames[key] = visual.BufferImageStim(window)
+        window.clearBuffer()
+
+    # Draw a cached screen, which is a single blit whatever the stimuli on it
+    def blit(self, key):
+        self.frames[key].draw()
+
+
+class EmojiStimulus(object):
+    """ This object is created to handle every aspect of the visual representation
+    of the emoji speller stimulus. It is created to simplify its use in other scripts
+    making the readability skyrocket (due to reasons like: not having 200 lines on a
+    main script) 
+
+    METHODS:
+        __init__: Initialises the window and the emoji images and places everything where
+            it is supposed to go. Also initialises the augmentation (blue rectangle). 
+            Accepts scalings (window_scaling, motion_scaling, stimulus_scaling) as keyword
+            arguments to change the relative size of those parameters with respect to the 
+            screen size. With markers=True it also opens a LSL marker outlet, with
+            frame_locked=True the durations are counted in frames instead of waited and
+            with frame_cache=True every screen is composited once and then blitted.
+        quit: Closes the PsychoPy's window and quits the PsychoPy's core
+        experiment_setup: Set-up an experiment with all the neede parameters. Please,
+            refer to that method's documentation to see all the arguments and usage.
+        shuffle: Create a new random array for random augmentation order
+        play_emoji: Draw an augmentation for the emoji in the given position by the
+            shuffle array.
+        mark_onset: Stamp an augmentation when it appears on screen (called on flip)
+        play_sequence: Play an entire sequence of augmentations in the order given
+            by the shuffle array
+        inter_sequence(callback): Wait (or count the frames of) the Inter Sequence
+            Interval, calling callback along it (which can cut it short)
+        play: Play the estimuli as set up.
+
+
+    ATTRIBUTES:
+        self.window: The window object of PsychoPy
+        self.stimuli: The stimuli object (class defined in this file) 
+            containing all the stimuli from PsychoPy.
+        self.num_emojis: Number of emoji images found
+        self.emoji_size: Size of the emojis (in px)
+        self.imXaxis: Positions of the emojis along the X axis.
+        self.pres_dur: Duration of initial presentation of stimuli
+        self.aug_dur: Duration of the augmentations
+        self.aug_wait: Time between augmentations
+        self.iseqi: Inter Sequence Interval duration
+        self.num_seq: Number of sequences per trial
+        self.sequence_duration: Time duration of each sequence
+        self.aug_shuffle: Shuffled list indicating which emoji is going 
+            to augment in each sequence.
+        self.marker_outlet: LSL outlet of the "Markers" stream (or None). Each marker
+            is [emoji, sequence, trial] stamped with the flip that showed it.
+        self.trial: Trial number sent with the markers (set by the experiment)
+        self.seq_onsets: LSL timestamps of the augmentations of the last sequence
+        self.refresh_rate: Measured refresh rate of the monitor (Hz)
+        self.frame_locked: Whether the timing is done by counting flips
+        self.aug_frames, self.wait_frames, self.iseqi_frames: Durations in frames
+        self.dropped_frames: Frames dropped during the last sequence (frame locked)
+        self.frame_cache: Whether the screens are cached in self.stimuli.frames
+        self.feedback_stamp: LSL timestamp of the flip that showed the last confirmation
+    """
+
+    def __init__(self, **kwargs):
+        # Get monitor dimensions directly from system and define window
+        try:    # For those cases in which user is not using Windows
+            monitor_dims = np.array([GetSystemMetrics(0),
+                                     GetSystemMetrics(1)])  # Monitor dimensions (px)
+        except:
+            monitor_dims = np.array([1920, 1080])
+
+        # print("Monitor dimensions: {0}".format(monitor_dims))
+
+        if "window_scaling" in kwargs:
+            window_scaling = kwargs["window_scaling"]
+        else:
+            window_scaling = 0.8
+
+        # Stimuli window dimensions (px)
+        window_dims = window_scaling * monitor_dims
+
+        # Stimulus scaling parameter
+        if "stimulus_scaling" in kwargs:
+            stimulus_scaling = kwargs["stimulus_scaling"]
+        else:
+            stimulus_scaling = 0.19
+
+        # Dimensions of the stimuli
+        stimulus_dim = np.round(window_dims[0] * stimulus_scaling)
+        # print("Stimulus dim: {0}". format(stimulus_dim))
+
+        # Create window
+        self.window = visual.Window(
+            window_dims, monitor="testMonitor", units="deg")
+
+        # Measure the monitor refresh rate in Hz (60 Hz if it can't be measured)
+        refresh_rate = self.window.getActualFrameRate()
+        if refresh_rate is None:
+            refresh_rate = 60
+        self.refresh_rate = refresh_rate
+        print("Refresh rate: {0:.2f} Hz ({1:.2f} ms per frame)".format(
+            refresh_rate, 1000/refresh_rate))
+
+        # Frame locked presentation: durations are counted in flips instead of waited
+        if "frame_locked" in kwargs:
+            self.frame_locked = kwargs["frame_locked"]
+        else:
+            self.frame_locked = False
+        if self.frame_locked:
+            # A flip taking longer than a frame (plus some slack) counts as dropped
+            self.window.recordFrameIntervals = True
+            self.window.refreshThreshold = 1/refresh_rate + 0.004
+        self.dropped_frames = 0
+
+        ## Stimuli parameters ##
+        # Stimuli holder
+        self.stimuli = Stimuli()
+
+        # Emoticon images
+        # Get a list with the path to the emoticon image files
+        emoji_path_list = glob.glob("1D Scale-Swaney-Stueve\\*.png")
+        num_emojis = len(emoji_path_list)
+        self.num_emojis = num_emojis
+        self.emoji_size = stimulus_dim/2
+
+        # Iterate over them to create the stimuli and the labels corresponding to the filename
+        for i in range(len(emoji_path_list)):
+            # Unpack the path string to get just filename without file format
+            label = emoji_path_list[i].split("\\")[1].split(".")[0]
+
+            # Create the stimuli
+            self.stimuli.add(visual.ImageStim(
+                win=self.window, image=emoji_path_list[i], units="pix", size=self.emoji_size), label)
+
+        # Order the negative emojis correctly
+        self.stimuli.swap(0, 2)
+
+        # Blue Augmentation Square Stim Parameters
+        self.stimuli.add(visual.Rect(win=self.window, units="pix", width=self.emoji_size,
+                                     height=self.emoji_size, fillColor=[-1, -1, 1], lineColor=[0, 0, 0]), "rectBlue")
+
+        ## Positioning ##
+        # Position across x-axis
+        emoji_pos = window_dims[0] * 0.8
+        self.imXaxis = np.linspace(
+            0 - emoji_pos/2, 0 + emoji_pos/2, num_emojis)
+
+        for i in range(num_emojis):
+            self.stimuli.items[i].pos = (self.imXaxis[i], 0)
+
+        # Stimuli of the confirmation screens
+        self.green_rect = visual.Rect(win=self.window, units="pix", width=self.emoji_size,
+                                      height=self.emoji_size, fillColor=[-1, 1, -1],
+                                      lineColor=[0, 0, 0])
+        self.confirm_text = visual.TextStim(win=self.window, pos=[0, -5],
+                                            text="Left = Accept. Right = Deny.")
+        self.feedback_text = visual.TextStim(win=self.window, pos=[0, -5],
+                                             text="From 1 to 7, which emoji was your target?")
+
+        ## Frame cache ##
+        # Composite the baseline and every augmentation once, so each one is a single blit.
+        # The confirmation screens are cached the first time they are shown.
+        if "frame_cache" in kwargs:
+            self.frame_cache = kwargs["frame_cache"]
+        else:
+            self.frame_cache = False
+        if self.frame_cache:
+            self.stimuli.cache(self.window, "baseline",
+                               lambda: self.stimuli.draw_int(0, -1))
+            for i in range(num_emojis):
+                self.stimuli.items[-1].pos = (self.imXaxis[i], 0)
+                self.stimuli.cache(self.window, ("augmentation", i))
+
+        ## Markers ##
+        # Stream with the augmentations, stamped when they actually appear on screen
+        if "markers" in kwargs and kwargs["markers"]:
+            marker_info = StreamInfo("Emoji Speller Markers", "Markers", 3, IRREGULAR_RATE,
+                                     "int32", "emoji_speller_markers")
+            self.marker_outlet = StreamOutlet(marker_info)
+        else:
+            self.marker_outlet = None
+        self.trial = 0
+
+        # Moment the last confirmation screen appeared (see confirm)
+        self.feedback_stamp = None
+
+    def quit(self):
+        self.window.close()
+        core.quit()
+
+    def experiment_setup(self, pres_duration=5, aug_duration=0.125, aug_wait=0,
+                         inter_seq_interval=0.375, seq_number=5, num_trials=1):
+        """
+        Set-up an emoji stimuli experiment.
+
+        All the units are SI units unless specified.
+
+        Arguments:
+            pres_duration: Duration of initial stimuli presentation
+            aug_duration: Duration of the augmentation on screen
+            aug_wait: Temporal distance between augmentations
+            inter_seq_interval: Time between sequences
+            seq_number: Number of sequences
+            num_trials: Number of trials
+            per_augmentations: Percentage (/100) of augmented squares per block
+
+        """
+        # Save experiment parameters in object
+        self.pres_dur = pres_duration
+        self.aug_dur = aug_duration
+        self.aug_wait = aug_wait
+        self.iseqi = inter_seq_interval
+        self.num_seq = seq_number
+        self.num_trials = num_trials
+
+        # Durations in whole frames, used when the presentation is frame locked
+        self.aug_frames = max(1, int(round(aug_duration * self.refresh_rate)))
+        self.wait_frames = int(round(aug_wait * self.refresh_rate))
+        self.iseqi_frames = int(round(inter_seq_interval * self.refresh_rate))
+
+        # Compute the duration of the experiment and get the timing of the events
+        if self.frame_locked:
+            self.sequence_duration = ((self.aug_frames + self.wait_frames) *
+                                      self.num_emojis / self.refresh_rate)
+        else:
+            self.sequence_duration = (aug_duration + aug_wait) * self.num_emojis
+        """ augmentation_times = np.linspace(
+            0, self.sequence_duration, self.num_emojis + 1)[:self.num_emojis] """
+
+        # Create sequence randomisation array
+        self.shuffle()
+
+        # Onsets of the augmentations of the sequence being played
+        self.seq_onsets = np.zeros(self.num_emojis)
+
+    def shuffle(self):
+        # Randomisation for augmentations
+        aug_shuffle = np.arange(
+            self.num_emojis * self.num_seq).reshape(self.num_seq, self.num_emojis)
+        for i in range(self.num_seq):
+            aug_shuffle[i, :] = np.arange(0, self.num_emojis, 1)
+            np.random.shuffle(aug_shuffle[i, :])
+        self.aug_shuffle = aug_shuffle
+
+    def play_emoji(self, s, e):
+        """ Draw emoji augmentation from sequence s and emoji e"""
+
+        # Move blue rectangle and draw everything
+        self.stimuli.items[-1].pos = (
+            self.imXaxis[self.aug_shuffle[s, e]], 0)
+
+        if self.frame_locked:
+            self.play_emoji_frames(s, e)
+            return
+
+        self.draw_augmentation(self.aug_shuffle[s, e])
+
+        # Window flip, stamping the moment the augmentation is shown
+        self.window.callOnFlip(self.mark_onset, s, e)
+        self.window.flip()
+
+        # Wait the aug_dur time
+        clock.wait(self.aug_dur)
+
+        # Draw just the emojis, getting rid of the rectangle
+        self.draw_baseline()
+
+        # Window flip
+        self.window.flip()
+
+        # Pause aug_wait time
+        clock.wait(self.aug_wait)
+
+    def play_emoji_frames(self, s, e):
+        """ Frame locked version of play_emoji: the augmentation stays aug_frames
+        flips on screen and the emojis alone wait_frames flips (at least one after
+        the last augmentation of the sequence, so it doesn't stay on screen) """
+
+        for frame in range(self.aug_frames):
+            self.draw_augmentation(self.aug_shuffle[s, e])
+            if frame == 0:
+                self.window.callOnFlip(self.mark_onset, s, e)
+            self.window.flip()
+
+        wait_frames = self.wait_frames
+        if e == self.num_emojis - 1:
+            wait_frames = max(wait_frames, 1)
+        for frame in range(wait_frames):
+            self.draw_baseline()
+            self.window.flip()
+
+    def draw_augmentation(self, index):
+        """ Draw the emojis with emoji index augmented (the rectangle has to be
+        there already if the frames are not cached) """
+        if self.frame_cache:
+            self.stimuli.blit(("augmentation", index))
+        else:
+            self.stimuli.draw()
+
+    def draw_baseline(self):
+        """ Draw just the emojis """
+        if self.frame_cache:
+            self.stimuli.blit("baseline")
+        else:
+            self.stimuli.draw_int(0, -1)
+
+    def mark_onset(self, s, e):
+        """ Stamp augmentation e of sequence s with the LSL clock and push its marker.
+        It is called by PsychoPy right after the flip that puts it on screen. """
+        stamp = local_clock()
+        self.seq_onsets[e] = stamp
+        if self.marker_outlet is not None:
+            self.marker_outlet.push_sample(
+                [int(self.aug_shuffle[s, e]), s + 1, self.trial], stamp)
+
+    def play_seq(self, s, callback=None):
+        """ Play sequence number s as aug_shuffle is ordered. If given, callback(s, e)
+        is called after each augmentation (e.g. to poll an Epocher). """
+
+        dropped = self.window.nDroppedFrames
+        with profiler.span("stimulus.sequence"):
+            for e in range(self.num_emojis):
+                self.play_emoji(s, e)
+                if callback is not None:
+                    with profiler.span("stimulus.callback"):
+                        callback(s, e)
+
+        # Report the frames dropped in the sequence
+        if self.frame_locked:
+            self.dropped_frames = self.window.nDroppedFrames - dropped
+            profiler.count("stimulus.dropped_frames", self.dropped_frames)
+            self.window.frameIntervals = []
+            if self.dropped_frames > 0:
+                print("Sequence {0}: {1} dropped frames".format(s + 1, self.dropped_frames))
+
+    def inter_sequence(self, callback=None):
+        """ Wait the Inter Sequence Interval time, or show the emojis alone for its
+        frames if the presentation is frame locked. If given, callback() is called
+        after every frame (every few ms if not frame locked), and the rest of the
+        interval is skipped when it returns True (e.g. once the trial can stop). """
+
+        if self.frame_locked:
+            for frame in range(self.iseqi_frames):
+                self.draw_baseline()
+                self.window.flip()
+                if callback is not None and callback():
+                    return
+        elif callback is None:
+            clock.wait(self.iseqi)
+        else:
+            end = local_clock() + self.iseqi
+            while local_clock() < end:
+                if callback():
+                    return
+                clock.wait(min(0.005, max(end - local_clock(), 0)))
+
+    def play(self):
+        """ Play all the sequences together """
+
+        for s in range(self.num_seq):
+            self.play_seq(s)
+
+            # Wait the Inter Sequence Interval time
+            self.inter_sequence()
+
+    def draw_confirm(self, index, transform=False):
+        """ Draw the confirmation screen of the emoji in position index """
+        # Highlight the chosen emoji
+        self.green_rect.pos = (self.imXaxis[index], 0)
+        self.green_rect.draw()
+
+        # Transform every emoji into the chosen one if asked and draw
+        if transform:
+            for i in range(self.num_emojis):
+                self.stimuli.items[index].pos = (self.imXaxis[i], 0)
+                self.stimuli.items[index].draw()
+            self.stimuli.items[index].pos = (self.imXaxis[index], 0)
+        else:  # Or just draw all emojis again
+            for i in range(self.num_emojis):
+                self.stimuli.items[i].draw()
+
+        # Explain the key use
+        self.confirm_text.draw()
+
+    def confirm(self, rel_position, transform=False):
+        start = local_clock()
+        index = rel_position-1
+        if self.frame_cache:
+            key = ("confirm", index, transform)
+            if key not in self.stimuli.frames:
+                self.stimuli.cache(self.window, key,
+                                   lambda: self.draw_confirm(index, transform))
+            self.stimuli.blit(key)
+        else:
+            self.draw_confirm(index, transform)
+
+        # Refresh the window
+        self.window.flip()
+        self.feedback_stamp = local_clock()
+        profiler.record("stimulus.confirm", start, self.feedback_stamp)
+
+        # Wait for the user to press a key
+        response = None
+        while response == None:
+            all_keys = event.getKeys()
+            for key in all_keys:
+                if key == "left":
+                    response = True
+                    rel_position_final = rel_position
+                elif key == "right":
+                    response = False
+                    rel_position_final = self.double_feedback()
+
+        # Print and return the response
+        print("The user said that the selection of emoji {0} is {1}".format(
+            rel_position, response))
+        if response == False:
+            print("The user said that emoji {0} was the target".format(rel_position_final))
+            
+        return [response, rel_position_final]
+
+    def double_feedback(self):
+        # If the user told us the emoji is not the right one, ask which one they wanted to spell
+        # (with all the emojis)
+        def draw_feedback():
+            self.feedback_text.draw()
+            self.stimuli.draw_int(0, self.num_emojis)
+
+        if self.frame_cache:
+            if "feedback" not in self.stimuli.frames:
+                self.stimuli.cache(self.window, "feedback", draw_feedback)
+            self.stimuli.blit("feedback")
+        else:
+            draw_feedback()
+
+        self.window.flip()
+
+        # Search for key presses
+        response = None
+        while response == None:
+            all_keys = event.getKeys()
+            for key in all_keys:
+                if str(key) in "1234567":
+                    response = key
+        
+        # Return the key
+        return response